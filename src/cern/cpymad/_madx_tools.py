@@ -89,3 +89,107 @@ def mad_command(*args, **kwargs):
     _args = list(args)
     _args += [mad_parameter(k, v) for k,v in kwargs.items()]
     return ', '.join(filter(None, _args)) + ';'
+
+
+def mad_sequence(name, length, elements, refer='centre'):
+    """
+    Create the MAD-X input that defines a sequence from columnar data.
+
+    :param str name: sequence name
+    :param float length: sequence length
+    :param dict elements: equal length arrays ``name``, ``class``, ``at`` and
+                          further numeric attributes (NaN if not set)
+    :param str refer: ``entry``, ``centre`` or ``exit``
+    :returns: command text
+    :rtype: str
+
+    Numbers are formatted without loss of precision. Elements are defined
+    inline, i.e. their names must be unique.
+    """
+    attrs = [(key, values) for key, values in elements.items()
+             if key not in ('name', 'class', 'at')]
+    lines = ['{}: sequence, l={!r}, refer={};'.format(
+        name, float(length), refer)]
+    rows = zip(elements['name'], elements['class'], elements['at'])
+    for i, (elem, cls, at) in enumerate(rows):
+        params = ''.join(', {}={!r}'.format(key, float(values[i]))
+                         for key, values in attrs
+                         if float(values[i]) == float(values[i]))  # not NaN
+        lines.append('{}: {}, at={!r}{};'.format(
+            _mad_str(elem), _mad_str(cls), float(at), params))
+    lines.append('endsequence;')
+    return '\n'.join(lines) + '\n'
+
+
+# phase space coordinates in the order used by START:
+_track_columns = ['x', 'px', 'y', 'py', 't', 'pt']
+
+
+def mad_track(particles, turns, observe=(), **kwargs):
+    """
+    Create the MAD-X input for tracking many particles.
+
+    :param particles: ``(N, 6)`` start coordinates ``x``, ``px``, ``y``,
+                      ``py``, ``t``, ``pt``
+    :param int turns: number of turns
+    :param list observe: names of observation points
+    :param kwargs: further keyword arguments to TRACK
+    :returns: command text (TRACK, OBSERVE, START, RUN, ENDTRACK)
+    :rtype: str
+    """
+    lines = [mad_command('track', **kwargs)]
+    lines += [mad_command('observe', place=place) for place in observe]
+    for particle in particles:
+        lines.append('start, {};'.format(', '.join(
+            '{}={!r}'.format(column, float(value))
+            for column, value in zip(_track_columns, particle))))
+    lines.append('run, turns={:d};'.format(turns))
+    lines.append('endtrack;')
+    return '\n'.join(lines) + '\n'
+
+
+def mad_seqedit(name, operations, flatten=True):
+    """
+    Create the MAD-X input for a SEQEDIT block with many operations.
+
+    :param str name: sequence name
+    :param list operations: list of ``(command, columns)`` pairs, where
+                            ``command`` is one of ``install``, ``move``,
+                            ``remove``, ``replace`` and ``columns`` is a
+                            mapping of equal length lists of command
+                            parameters (``element``, ``class``, ``at``,
+                            ``from``, ``by``, ``to``). ``None`` entries are
+                            omitted.
+    :param bool flatten: flatten the sequence after editing
+    :returns: command text
+    :rtype: str
+    :raises ValueError: if a command is invalid
+    """
+    lines = ['seqedit, sequence={};'.format(name)]
+    for command, columns in operations:
+        if command not in ('install', 'move', 'remove', 'replace'):
+            raise ValueError("Invalid SEQEDIT command: {!r}".format(command))
+        keys = list(columns)
+        for row in zip(*[columns[key] for key in keys]):
+            params = ''.join(', {}={}'.format(key, _mad_value(value))
+                             for key, value in zip(keys, row)
+                             if value is not None)
+            lines.append('{}{};'.format(command, params))
+    if flatten:
+        lines.append('flatten;')
+    lines.append('endedit;')
+    return '\n'.join(lines) + '\n'
+
+
+def _mad_value(value):
+    """Format a parameter value without loss of precision."""
+    if isinstance(value, (bytes, basestring)):
+        return _mad_str(value)
+    return repr(float(value))
+
+
+def _mad_str(value):
+    """Convert bytes (e.g. from numpy ``S`` arrays) to python string."""
+    if isinstance(value, bytes) and not isinstance(value, str):
+        return value.decode('utf-8')
+    return value
@@ -34,6 +34,8 @@ of the C-API of MAD-X.
 cdef extern from "madX/mad_def.h":
     enum:
         NAME_L
+        ALIGN_MAX
+        FIELD_MAX
 
 cdef extern from "madX/mad_array.h":
     struct char_array:
@@ -87,6 +89,28 @@ cdef extern from "madX/mad_expr.h":
         int curr
         expression** list
 
+cdef extern from "madX/mad_var.h":
+    struct variable:
+        char[NAME_L] name
+        int type
+        int val_type
+        char* string
+        expression* expr
+        double value
+
+    # NOTE: the struct is called 'variable_list' in C, just like the global
+    # variable that holds all variables:
+    struct var_list "variable_list":
+        int curr
+        name_list* list
+        variable** vars
+
+cdef enum:
+    VAR_TYPE_CONSTANT = 0
+    VAR_TYPE_DIRECT = 1
+    VAR_TYPE_DEFERRED = 2
+    VAR_TYPE_STRING = 3
+
 cdef extern from "madX/mad_cmdpar.h":
     struct command_parameter:
         char[NAME_L] name
@@ -128,13 +152,20 @@ cdef enum:
 cdef extern from "madX/mad_cmd.h":
     struct command:
         int beam_def
+        name_list* par_names
         command_parameter_list* par
 
 cdef extern from "madX/mad_elem.h":
     struct element:
         char[NAME_L] name
+        double length
         command* def_ "def"
 
+    struct el_list:
+        int curr
+        name_list* list
+        element** elem
+
 cdef extern from "madX/mad_node.h":
     struct node:
         char[NAME_L] name
@@ -142,6 +173,8 @@ cdef extern from "madX/mad_node.h":
         double at_value
         double length
         element* p_elem
+        double_array* p_al_err
+        double_array* p_fd_err
 
     struct node_list:
         int curr
@@ -175,6 +208,8 @@ cdef enum:
 cdef extern from "madX/mad_gvar.h":
     sequence* current_sequ      # active sequence
     table_list* table_register  # list of all tables
+    var_list* variable_list     # list of all global variables
+    el_list* element_list       # list of all element definitions
     char_p_array* tmp_p_array   # temporary buffer for splits
     char_array* c_dum           # another temporary buffer
 
@@ -190,17 +225,33 @@ cdef extern from "madX/mad_core.h":
 cdef extern from "madX/mad_name.h":
     int name_list_pos(char*, name_list*)  # NOTE: C API uses "const char*"
 
+cdef extern from "madX/mad_array.h":
+    double_array* new_double_array(int)
+    double_array* delete_double_array(double_array*)
+
 cdef extern from "madX/mad_str.h":
     void stolower_nq(char*)
     int mysplit(char*, char_p_array*)
+    char* tmpbuff(char*)                # NOTE: C API uses "const char*"
 
 cdef extern from "madX/mad_eval.h":
-    void pro_input(char*)
+    void pro_input(char*) nogil
 
 cdef extern from "madX/mad_expr.h":
     expression* make_expression(int, char**)
     double expression_value(expression*, int)
     expression* delete_expression(expression*)
+    expression* clone_expression(expression*)
+    expr_list* new_expr_list(int)
+    expr_list* delete_expr_list(expr_list*)
+
+cdef extern from "madX/mad_var.h":
+    variable* find_variable(char*, var_list*)   # NOTE: C API uses "const char*"
+    double variable_value(variable*)
+    void set_variable(char*, double*)
+
+cdef extern from "madX/mad_elem.h":
+    element* find_element(char*, el_list*)  # NOTE: C API uses "const char*"
 
 cdef extern from "madX/mad_parse.h":
     void pre_split(char*, char_array*, int)
@@ -208,6 +259,9 @@ cdef extern from "madX/mad_parse.h":
 cdef extern from "madX/mad_table.h":
     char_p_array* table_get_header(char* table_name)
     int table_exists(char* table_name)
+    table* make_table(char* name, char* type, char** table_cols,
+                      int* table_types, int rows)
+    void add_to_table_list(table*, table_list*)
 
 
 # I have no clue why, but for some reason, it is necessary to include
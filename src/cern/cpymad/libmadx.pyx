@@ -6,6 +6,10 @@ CAUTION: this module maps the global architecture of the MAD-X library
 closely. That means that all functions will operate on a shared global
 state! Take this into account when importing this module.
 
+The GIL is released while MAD-X processes input and while copying table
+data. Other threads can run in the meantime, but they must not call any
+functions of this module concurrently.
+
 Probably, you want to interact with MAD-X via the cpymad.madx module. It
 provides higher level abstraction and can deal with multiple instances of
 MAD-X. Furthermore, it enhances the security by boxing all MAD-X calls into
@@ -13,8 +17,11 @@ a subprocess.
 """
 
 from os import chdir, getcwd
+from collections import OrderedDict
 
 import ctypes
+import hashlib
+import re
 import numpy as np      # Import the Python-level symbols of numpy
 
 # Import a large-enough integer type to hold pointer, see also:
@@ -22,13 +29,46 @@ import numpy as np      # Import the Python-level symbols of numpy
 cdef extern from "pyport.h":
     ctypedef int Py_intptr_t
 
-from cern.cpymad.types import Constraint, Expression
+from cern.cpymad.types import Categorical, Constraint, Expression, RowFilter
 cimport cern.cpymad.clibmadx as clib
 
+cimport cython
+from libc.math cimport NAN
+from libc.stdlib cimport malloc, free
+from libc.string cimport strlen, memcpy
+
+cdef extern from "ctype.h":
+    int isspace(int c) nogil
+    int tolower(int c) nogil
+
 
 # Remember whether start() was called
 _madx_started = False
 
+# Change counters {name: version} of tables and sequences, see
+# _bump_versions():
+_table_versions = {}
+_sequence_versions = {}
+
+# Commands that never modify tables or sequences, see _input_effects():
+_readonly_commands = frozenset([
+    'option', 'show', 'value', 'print', 'title', 'help', 'select', 'set',
+])
+
+# LRU cache of parsed expressions {normalized string: _ParsedExpression}:
+_expr_cache = OrderedDict()
+_expr_cache_maxsize = 1024
+_expr_cache_hits = 0
+_expr_cache_misses = 0
+
+# Digests of the fingerprint scopes of the active sequence, that are reused
+# as long as the sequence version is unchanged {scope: (key, digest)}:
+_fingerprint_cache = {}
+
+# Saved variable/element states, see `snapshot()`:
+_snapshots = {}
+_snapshot_counter = 0
+
 
 # Python-level binding to libmadx:
 __all__ = [
@@ -45,10 +85,33 @@ __all__ = [
     'get_table_list',
     'get_table_summary',
     'get_table_column',
+    'get_table',
+    'create_table',
+    'get_table_version',
+    'get_rmatrices',
     'get_elements',
     'get_expanded_elements',
+    'get_normalized_elements',
+    'get_element_table',
     'is_expanded',
+    'get_sequence_version',
     'evaluate',
+    'evaluate_many',
+    'get_expression_cache_info',
+    'set_expression_cache_size',
+    'clear_expression_cache',
+    'get_variables',
+    'set_variables',
+    'get_globals',
+    'get_dependency_graph',
+    'get_state_fingerprint',
+    'snapshot',
+    'restore',
+    'discard_snapshot',
+    'set_element_attributes',
+    'assign_errors',
+    'get_errors',
+    'get_track_data',
     # these are imported from 'os' for convenience in madx.Madx and should
     # not really be considered part of the public interface:
     'chdir',
@@ -79,6 +142,8 @@ def finish():
     """
     Cleanup MAD-X.
     """
+    clear_expression_cache()
+    _snapshots.clear()
     clib.madx_finish()
     global _madx_started
     _madx_started = False
@@ -91,8 +156,17 @@ def input(cmd):
     :param str cmd: command to be executed by the MAD-X interpretor
     """
     cdef bytes _cmd = _cstr(cmd)
-    clib.stolower_nq(_cmd)
-    clib.pro_input(_cmd)
+    cdef char* _cmd_ptr = _cmd
+    clib.stolower_nq(_cmd_ptr)
+    # Release the GIL, so other python threads in this process can continue
+    # running during long computations (TWISS, MATCH, ...):
+    with nogil:
+        clib.pro_input(_cmd_ptr)
+    tables, sequences = _input_effects(cmd)
+    if tables:
+        _bump_versions(_table_versions, _table_names())
+    if sequences:
+        _bump_versions(_sequence_versions, _sequence_names())
 
 
 def sequence_exists(sequence):
@@ -180,6 +254,24 @@ def table_exists(table):
     return bool(clib.table_exists(_table))
 
 
+def get_table_version(table):
+    """
+    Get the change counter of a table.
+
+    :param str table: table name
+    :returns: counter that increases whenever the table may have changed
+    :rtype: int
+    :raises ValueError: if the table name is invalid
+
+    The version can be used to check cheaply whether cached table data is
+    still up-to-date. It is increased for all tables after any input that
+    is not known to be read-only (such as OPTION or SHOW), so it may also
+    increase when the data did not actually change.
+    """
+    _find_table(table)
+    return _table_versions.get(table, 0)
+
+
 def get_table_list():
     """
     Return list of all table names.
@@ -201,11 +293,9 @@ def get_table_summary(table):
     """
     cdef bytes _table = _cstr(table)
     cdef clib.char_p_array* header = clib.table_get_header(_table)
-    cdef int i
     if header is NULL:
         raise ValueError("No summary for table: {!r}".format(table))
-    return dict([_split_header_line(header.p[i])
-                 for i in xrange(header.curr)])
+    return _get_summary(header)
 
 
 def get_table_columns(table):
@@ -217,19 +307,22 @@ def get_table_columns(table):
     :rtype: list
     :raises ValueError: if the table name is invalid
     """
-    cdef bytes _table = _cstr(table)
-    cdef int index = clib.name_list_pos(_table, clib.table_register.names)
-    if index == -1:
-        raise ValueError("Invalid table: {!r}".format(table))
-    return _name_list(clib.table_register.tables[index].columns)
+    return _name_list(_find_table(table).columns)
 
 
-def get_table_column(table, column):
+def get_table_column(table, column, rows=None, strip=False, lower=False,
+                     as_unicode=False, categorical=False):
     """
     Get data from the specified table.
 
     :param str table: table name
     :param str column: column name
+    :param rows: row selection, see below
+    :param bool strip: strip surrounding whitespace from string values
+    :param bool lower: convert string values to lowercase
+    :param bool as_unicode: return string columns with unicode (``U``)
+                            instead of bytes (``S``) dtype
+    :param bool categorical: return string columns as :class:`Categorical`
     :returns: the data in the requested column
     :rtype: numpy.array
     :raises ValueError: if the column cannot be found in the table
@@ -239,92 +332,370 @@ def get_table_column(table, column):
     sure to copy all data before invoking any further MAD-X commands! This
     is done automatically for you if using libmadx in a remote service
     (pickle serialization effectively copies the data).
+
+    Rows can be selected by passing one of the following as ``rows``:
+
+    - ``None`` for all rows
+    - a ``slice`` object
+    - a sequence of row indices or a boolean mask
+    - a :class:`RowFilter` with name/keyword/s-range criteria
+
+    Only the selected rows are copied, which keeps the transfered data small
+    when using libmadx in a remote service.
+
+    With ``categorical=True``, string columns are dictionary encoded, i.e.
+    only the distinct values and an int32 code per row are returned. This
+    greatly reduces the data size for repetitive columns like ``keyword``.
     """
-    cdef char** char_tmp
-    cdef bytes _tab_name = _cstr(table)
-    cdef bytes _col_name = _cstr(column)
-    cdef clib.column_info info
-    # The following snippet imitates the table_get_column function from the
-    # C API of the MAD-X library. The replacement is needed for proper
-    # handling of integer columns for as long as we support versions of
-    # MAD-X before r4777. When this is not the case anymore, you should be
-    # able to safely revert the commit that introduced this snippet:
-    cdef int tab_i = clib.name_list_pos(_tab_name, clib.table_register.names)
-    if tab_i == -1:
-        raise ValueError("Invalid table: {!r}".format(table))
-    cdef clib.table* _table = clib.table_register.tables[tab_i]
-    cdef int col_i = clib.name_list_pos(_col_name, _table.columns)
-    if col_i == -1:
-        raise ValueError("Invalid column: {!r}".format(column))
-    info.length = _table.curr
-    cdef int inform = _table.columns.inform[col_i]
-    if inform == clib.PARAM_TYPE_INTEGER:
-        # YES, integers are internally stored as doubles in MAD-X:
-        info.data = _table.d_cols[col_i]
-        info.datatype = b'i'
-    elif inform == clib.PARAM_TYPE_DOUBLE:
-        info.data = _table.d_cols[col_i]
-        info.datatype = b'd'
-    elif inform == clib.PARAM_TYPE_STRING:
-        info.data = _table.s_cols[col_i]
-        info.datatype = b'S'
-    else:
-        raise RuntimeError("Unknown column format: {!r}".format(inform))
-    # Although, we are using a custom replacement for table_get_column
-    # above, we still try to be fully compatible with the real function from
-    # MAD-X below, so back-migration will be easier, when the time comes.
-    # This is why the error and data type handling below is left untouched:
-    dtype = <bytes> info.datatype
-    size = <int> info.length
-    addr = <Py_intptr_t> info.data
-    # double:
-    if dtype == b'i' or dtype == b'd':
-        # YES, integers are internally stored as doubles in MAD-X:
-        array_type = ctypes.c_double * size
-        array_data = array_type.from_address(addr)
-        return np.ctypeslib.as_array(array_data)
-    # string:
-    elif dtype == b'S':
-        char_tmp = <char**> info.data
-        return np.array([char_tmp[i] for i in xrange(info.length)])
-    # invalid:
-    elif dtype == b'V':
-        raise ValueError("Column {!r} is not in table {!r}."
-                         .format(column, table))
-    # unknown:
+    cdef clib.table* _table = _find_table(table)
+    return _get_column(_table, column, _select_rows(_table, rows),
+                       strip, lower, as_unicode, categorical)
+
+
+def get_table(table, columns=None, rows=None, strip=False, lower=False,
+              as_unicode=False, categorical=False):
+    """
+    Get data and summary of the specified table in a single call.
+
+    :param str table: table name
+    :param list columns: column names or ``None`` for all columns
+    :param rows: row selection, see :func:`get_table_column`
+    :param bool strip: strip surrounding whitespace from string values
+    :param bool lower: convert string values to lowercase
+    :param bool as_unicode: return string columns with unicode (``U``)
+                            instead of bytes (``S``) dtype
+    :param bool categorical: return string columns as :class:`Categorical`
+    :returns: tuple ``(data, summary)`` with the mapping ``{column: array}``
+              and the summary mapping (or ``None`` if there is no summary)
+    :rtype: tuple
+    :raises ValueError: if the table or a column cannot be found
+
+    Contrary to :func:`get_table_column`, all returned data is copied.
+    """
+    cdef clib.table* _table = _find_table(table)
+    if columns is None:
+        columns = _name_list(_table.columns)
+    _rows = _select_rows(_table, rows)
+    data = {}
+    for column in columns:
+        col = _get_column(_table, column, _rows, strip, lower, as_unicode,
+                          categorical)
+        if _rows is None and not isinstance(col, Categorical) and \
+                col.dtype == np.float64:
+            col = col.copy()
+        data[column] = col
+    if _table.header is NULL:
+        summary = None
     else:
-        raise RuntimeError("Unknown datatype {!r} in column {!r}."
-                           .format(_str(dtype), column))
+        summary = _get_summary(_table.header)
+    return data, summary
 
 
-def get_elements(sequence_name):
+def create_table(table, columns):
+    """
+    Create a table from column data.
+
+    :param str table: table name, an existing table is replaced
+    :param columns: mapping ``{column: values}`` (use an ``OrderedDict`` to
+                    control the column order)
+    :raises ValueError: if the columns have different lengths
+    :raises TypeError: if a value can not be converted to the column type
+
+    Columns with string values (``S``, ``U`` or object dtype) are created as
+    string columns, all others are converted to float64.
+    """
+    items = [(name.lower(), np.asarray(values))
+             for name, values in columns.items()]
+    lengths = set(len(values) for name, values in items)
+    if len(lengths) > 1:
+        raise ValueError("Columns have different lengths: {}"
+                         .format(sorted(lengths)))
+    cdef int num_rows = lengths.pop() if lengths else 0
+    cdef int num_cols = len(items)
+    # convert all values before creating the table, so that invalid values
+    # don't leave a partially filled table behind:
+    data = [_table_column_data(name, values) for name, values in items]
+    cdef int i, k
+    cdef bytes _table_name = _cstr(table.lower())
+    cdef bytes _value
+    cdef clib.table* _table
+    cdef double[::1] _data
+    # allocate one more entry for the terminating sentinel:
+    cdef char** names = <char**> malloc((num_cols + 1) * sizeof(char*))
+    cdef int* types = <int*> malloc((num_cols + 1) * sizeof(int))
+    if names is NULL or types is NULL:
+        free(names)
+        free(types)
+        raise MemoryError
+    # make_table copies the column names, the python objects only need to
+    # be kept alive until then:
+    _names = [_cstr(name) for name, values in items]
+    try:
+        for i, (name, values) in enumerate(items):
+            _value = _names[i]
+            names[i] = _value
+            if isinstance(data[i], list):
+                types[i] = clib.PARAM_TYPE_STRING
+            else:
+                types[i] = clib.PARAM_TYPE_DOUBLE
+        names[num_cols] = b" "
+        types[num_cols] = 0
+        _table = clib.make_table(_table_name, b"user", names, types,
+                                 max(num_rows, 1))
+    finally:
+        free(names)
+        free(types)
+    for i, values in enumerate(data):
+        if isinstance(values, list):
+            for k in range(num_rows):
+                _value = values[k]
+                # the table owns (and frees) the copied strings:
+                _table.s_cols[i][k] = clib.tmpbuff(_value)
+        else:
+            _data = values
+            for k in range(num_rows):
+                _table.d_cols[i][k] = _data[k]
+    _table.curr = num_rows
+    clib.add_to_table_list(_table, clib.table_register)
+    _bump_versions(_table_versions, [_str(_table_name)])
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def get_rmatrices(table, rows=None):
+    """
+    Get the transfer matrices ``re11`` .. ``re66`` of a table.
+
+    :param str table: table name
+    :param rows: row selection, see :func:`get_table_column`
+    :returns: array ``(rows, 6, 6)`` with the transfer matrix of each row
+    :rtype: numpy.ndarray
+    :raises ValueError: if the table has no transfer matrix columns
+
+    The matrices are available in the twiss table if TWISS was invoked with
+    the ``rmatrix`` option.
+    """
+    cdef clib.table* _table = _find_table(table)
+    cdef double* cols[36]
+    cdef bytes _col_name
+    cdef int i, j, pos
+    for i in range(6):
+        for j in range(6):
+            _col_name = _cstr('re{}{}'.format(i + 1, j + 1))
+            pos = clib.name_list_pos(_col_name, _table.columns)
+            if pos == -1 or _table.columns.inform[pos] != clib.PARAM_TYPE_DOUBLE:
+                raise ValueError("Table {!r} has no column {!r}."
+                                 .format(table, _str(_col_name)))
+            cols[6*i + j] = _table.d_cols[pos]
+    _rows = _select_rows(_table, rows)
+    if _rows is None:
+        _rows = np.arange(_table.curr, dtype=np.intp)
+    cdef Py_ssize_t[::1] row_indices = _rows
+    cdef Py_ssize_t k, num = row_indices.shape[0]
+    result = np.empty((num, 6, 6))
+    cdef double[:, :, ::1] _result = result
+    with nogil:
+        for k in range(num):
+            for i in range(6):
+                for j in range(6):
+                    _result[k, i, j] = cols[6*i + j][row_indices[k]]
+    return result
+
+
+def get_elements(sequence_name, lazy=False, sparse=False):
     """
     Return list of all elements in the original sequence.
 
     :param str sequence_name: sequence name
+    :param bool lazy: do not evaluate symbolic expressions, see below
+    :param bool sparse: return only explicitly set parameters, see below
     :returns: all elements in the original sequence
     :rtype: list
     :raises ValueError: if the sequence is invalid.
+
+    In lazy mode, :class:`Expression` values are taken from the values last
+    computed by MAD-X instead of evaluating each expression. These values
+    may be outdated. Use :func:`evaluate_many` to update them in one call.
+
+    In sparse mode, parameters that have their default values (i.e. were
+    neither set explicitly nor assigned an expression) are omitted. The
+    keys ``name``, ``type`` and ``at`` are always present.
     """
     cdef clib.sequence* seq = _find_sequence(sequence_name)
-    return [_get_node(seq.nodes.nodes[i], seq.ref_flag)
+    return [_get_node(seq.nodes.nodes[i], seq.ref_flag, lazy, sparse)
             for i in xrange(seq.nodes.curr)]
 
 
-def get_expanded_elements(sequence_name):
+def get_expanded_elements(sequence_name, lazy=False, sparse=False):
     """
     Return list of all elements in the expanded sequence.
 
     :param str sequence_name: sequence name
+    :param bool lazy: do not evaluate symbolic expressions, see
+                      :func:`get_elements`
+    :param bool sparse: return only explicitly set parameters, see
+                        :func:`get_elements`
     :returns: all elements in the expanded sequence
     :rtype: list
     :raises ValueError: if the sequence is invalid.
     """
     cdef clib.sequence* seq = _find_sequence(sequence_name)
-    return [_get_node(seq.all_nodes[i], seq.ref_flag)
+    return [_get_node(seq.all_nodes[i], seq.ref_flag, lazy, sparse)
             for i in xrange(seq.n_nodes)]
 
 
+def get_normalized_elements(sequence_name, expanded=False,
+                            lazy=False, sparse=False):
+    """
+    Return the distinct element definitions and a compact node table.
+
+    :param str sequence_name: sequence name
+    :param bool expanded: use the expanded instead of the original sequence
+    :param bool lazy: do not evaluate symbolic expressions, see
+                      :func:`get_elements`
+    :param bool sparse: return only explicitly set parameters, see
+                        :func:`get_elements`
+    :returns: tuple ``(definitions, nodes)``
+    :rtype: tuple
+    :raises ValueError: if the sequence is invalid.
+
+    ``definitions`` is a list with the parameters of each element definition
+    used in the sequence (including the ``name`` and ``type`` of the
+    definition). Each definition is parsed only once, no matter how many
+    nodes share it. ``nodes`` is a mapping of arrays ``name``,
+    ``definition`` (index into ``definitions``), ``at`` and ``l``.
+    """
+    cdef clib.sequence* seq = _find_sequence(sequence_name)
+    cdef clib.node** nodes
+    cdef clib.node* node
+    cdef int i, num
+    if expanded:
+        nodes = seq.all_nodes
+        num = seq.n_nodes
+    else:
+        nodes = seq.nodes.nodes
+        num = seq.nodes.curr
+    definitions = []
+    indices = {}
+    index = np.empty(num, dtype=np.int32)
+    at = np.empty(num)
+    length = np.empty(num)
+    cdef int[::1] _index = index
+    cdef double[::1] _at = at
+    cdef double[::1] _length = length
+    # allocate one more entry to avoid zero-size allocations:
+    cdef char** names = <char**> malloc((num + 1) * sizeof(char*))
+    if names is NULL:
+        raise MemoryError
+    try:
+        for i in range(num):
+            node = nodes[i]
+            if node.p_elem is NULL:
+                raise RuntimeError("Empty node or subsequence! Please report this incident!")
+            key = <size_t> node.p_elem
+            if key not in indices:
+                indices[key] = len(definitions)
+                data = _get_element(node.p_elem, lazy, sparse)
+                data.update({'name': _str(node.p_elem.name),
+                             'type': _str(node.base_name)})
+                definitions.append(data)
+            names[i] = node.name
+            _index[i] = indices[key]
+            _at[i] = _node_at(node, seq.ref_flag)
+            _length[i] = node.length
+        name = _str_array(names, np.arange(num, dtype=np.intp), False, False)
+    finally:
+        free(names)
+    return definitions, {'name': name.astype('U'),
+                         'definition': index,
+                         'at': at,
+                         'l': length}
+
+
+def get_element_table(sequence_name, attributes=(), expanded=False,
+                      as_unicode=False):
+    """
+    Return columnar data for all elements in a sequence.
+
+    :param str sequence_name: sequence name
+    :param list attributes: names of additional numeric element attributes
+    :param bool expanded: use the expanded instead of the original sequence
+    :param bool as_unicode: return string columns with unicode (``U``)
+                            instead of bytes (``S``) dtype
+    :returns: mapping ``{column: numpy.array}`` with the columns ``name``,
+              ``type``, ``at``, ``l`` and the requested attributes
+    :rtype: dict
+    :raises ValueError: if the sequence is invalid.
+
+    Values of attributes that are not defined for an element are NaN.
+    Contrary to :func:`get_elements`, this function does not parse all
+    command parameters of every element and is therefore much faster.
+    """
+    cdef clib.sequence* seq = _find_sequence(sequence_name)
+    cdef clib.node** nodes
+    cdef int num
+    if expanded:
+        nodes = seq.all_nodes
+        num = seq.n_nodes
+    else:
+        nodes = seq.nodes.nodes
+        num = seq.nodes.curr
+    _attrs = [_cstr(attr.lower()) for attr in attributes]
+    cdef int num_attrs = len(_attrs)
+    cdef int i, j, pos
+    cdef bytes _attr
+    cdef clib.node* node
+    cdef clib.command* cmd
+    at = np.empty(num)
+    length = np.empty(num)
+    values = np.empty((num_attrs, num))
+    values.fill(np.nan)
+    cdef double[::1] _at = at
+    cdef double[::1] _length = length
+    cdef double[:, ::1] _values = values
+    # allocate one more entry to avoid zero-size allocations:
+    cdef char** names = <char**> malloc((num + 1) * sizeof(char*))
+    cdef char** types = <char**> malloc((num + 1) * sizeof(char*))
+    cdef char** attrs = <char**> malloc((num_attrs + 1) * sizeof(char*))
+    if names is NULL or types is NULL or attrs is NULL:
+        free(names)
+        free(types)
+        free(attrs)
+        raise MemoryError
+    try:
+        for j in range(num_attrs):
+            _attr = _attrs[j]
+            attrs[j] = _attr
+        for i in range(num):
+            node = nodes[i]
+            if node.p_elem is NULL:
+                raise RuntimeError("Empty node or subsequence! Please report this incident!")
+            names[i] = node.name
+            types[i] = node.base_name
+            _at[i] = _node_at(node, seq.ref_flag)
+            _length[i] = node.length
+            cmd = node.p_elem.def_
+            for j in range(num_attrs):
+                pos = clib.name_list_pos(attrs[j], cmd.par_names)
+                if pos != -1:
+                    _values[j, i] = _get_param_double(cmd.par.parameters[pos])
+        rows = np.arange(num, dtype=np.intp)
+        data = {'name': _str_array(names, rows, False, False),
+                'type': _str_array(types, rows, False, False)}
+    finally:
+        free(names)
+        free(types)
+        free(attrs)
+    if as_unicode:
+        data['name'] = data['name'].astype('U')
+        data['type'] = data['type'].astype('U')
+    data['at'] = at
+    data['l'] = length
+    for j, attr in enumerate(attributes):
+        data[attr.lower()] = values[j]
+    return data
+
+
 def is_expanded(sequence_name):
     """
     Check whether a sequence has already been expanded.
@@ -338,6 +709,24 @@ def is_expanded(sequence_name):
     return seq.n_nodes > 0
 
 
+def get_sequence_version(sequence_name):
+    """
+    Get the change counter of a sequence.
+
+    :param str sequence_name: sequence name
+    :returns: counter that increases whenever the sequence may have
+              changed, see :func:`get_table_version`
+    :rtype: int
+    :raises ValueError: if the sequence name is invalid
+
+    Changes of element attributes and errors made with
+    :func:`set_element_attributes`, :func:`assign_errors` or
+    :func:`restore` increase the version as well.
+    """
+    _find_sequence(sequence_name)
+    return _sequence_versions.get(sequence_name, 0)
+
+
 def evaluate(cmd):
     """
     Evaluates an expression and returns the result as double.
@@ -346,33 +735,797 @@ def evaluate(cmd):
     :returns: numeric value of the expression
     :rtype: float
 
+    :raises ValueError: if the expression can not be parsed
+
+    The parsed expression is kept in a cache, so repeated evaluations of the
+    same expression only need to recompute its value with the current
+    variables, see :func:`get_expression_cache_info`.
+    """
+    cdef _ParsedExpression parsed = _parse_expression(cmd)
+    return clib.expression_value(parsed.expr, 2)
+
+
+def get_expression_cache_info():
+    """
+    Get statistics of the expression cache used by :func:`evaluate`.
+
+    :returns: mapping with the keys ``hits``, ``misses``, ``size`` and
+              ``maxsize``
+    :rtype: dict
+    """
+    return {'hits': _expr_cache_hits,
+            'misses': _expr_cache_misses,
+            'size': len(_expr_cache),
+            'maxsize': _expr_cache_maxsize}
+
+
+def set_expression_cache_size(maxsize):
+    """
+    Set the maximum number of parsed expressions to keep in the cache.
+
+    :param int maxsize: maximum cache size, ``0`` disables the cache
+    """
+    global _expr_cache_maxsize
+    _expr_cache_maxsize = max(0, maxsize)
+    while len(_expr_cache) > _expr_cache_maxsize:
+        _expr_cache.popitem(last=False)
+
+
+def clear_expression_cache():
+    """Remove all parsed expressions from the cache and reset statistics."""
+    global _expr_cache_hits, _expr_cache_misses
+    _expr_cache.clear()
+    _expr_cache_hits = 0
+    _expr_cache_misses = 0
+
+
+def evaluate_many(exprs):
+    """
+    Evaluate a list of expressions.
+
+    :param list exprs: symbolic expressions to evaluate
+    :returns: tuple ``(values, errors)`` of a float64 array with the values
+              and a boolean array that marks invalid expressions, whose
+              values are NaN
+    :rtype: tuple
+    """
+    cdef int i, num = len(exprs)
+    cdef _ParsedExpression parsed
+    values = np.empty(num)
+    errors = np.zeros(num, dtype=bool)
+    cdef double[::1] _values = values
+    for i, expr in enumerate(exprs):
+        try:
+            parsed = _parse_expression(expr)
+        except (ValueError, AttributeError):
+            _values[i] = NAN
+            errors[i] = True
+        else:
+            _values[i] = clib.expression_value(parsed.expr, 2)
+    return values, errors
+
+
+def get_variables(names):
+    """
+    Get the values of global variables.
+
+    :param list names: variable names
+    :returns: variable values
+    :rtype: numpy.ndarray
+    :raises KeyError: if a variable is not defined
+    """
+    cdef int i
+    cdef bytes _name
+    cdef clib.variable* var
+    values = np.empty(len(names))
+    cdef double[::1] _values = values
+    for i, name in enumerate(names):
+        _name = _cstr(name.lower())
+        var = clib.find_variable(_name, clib.variable_list)
+        if var is NULL:
+            raise KeyError(name)
+        _values[i] = clib.variable_value(var)
+    return values
+
+
+def set_variables(names, values=None):
+    """
+    Set the values of global variables.
+
+    :param names: variable names or a mapping ``{name: value}``
+    :param values: values as array (or scalar) if ``names`` is a list
+    :raises ValueError: if the number of names and values do not match
+
+    This is equivalent to a direct assignment ``name = value;`` in MAD-X,
+    i.e. deferred expressions are replaced by the value. Values are passed
+    in full double precision without being formatted as text.
+    """
+    if values is None:
+        items = list(names.items())
+        names = [name for name, value in items]
+        values = [value for name, value in items]
+    cdef int i
+    cdef bytes _name
+    _values = np.empty(len(names))
+    _values[:] = values
+    cdef double[::1] _data = _values
+    for i, name in enumerate(names):
+        _name = _cstr(name.lower())
+        clib.set_variable(_name, &_data[i])
+    # same as for assignments in input():
+    if len(names):
+        _bump_versions(_sequence_versions, _sequence_names())
+
+
+def get_globals(as_unicode=False):
+    """
+    Return all global variables in columnar form.
+
+    :param bool as_unicode: return string columns with unicode (``U``)
+                            instead of bytes (``S``) dtype
+    :returns: mapping with the arrays ``name``, ``value``, ``expr`` and
+              ``kind``
+    :rtype: dict
+
+    ``kind`` is one of ``constant``, ``direct``, ``deferred`` or ``string``.
+    ``expr`` contains the defining expression of a variable (empty if there
+    is none) or the value of string variables, whose ``value`` is NaN.
+    """
+    cdef clib.var_list* variables = clib.variable_list
+    cdef int i, num = variables.curr
+    cdef clib.variable* var
+    values = np.empty(num)
+    kinds = np.empty(num, dtype=np.int8)
+    cdef double[::1] _values = values
+    cdef signed char[::1] _kinds = kinds
+    # allocate one more entry to avoid zero-size allocations:
+    cdef char** names = <char**> malloc((num + 1) * sizeof(char*))
+    cdef char** exprs = <char**> malloc((num + 1) * sizeof(char*))
+    if names is NULL or exprs is NULL:
+        free(names)
+        free(exprs)
+        raise MemoryError
+    try:
+        for i in range(num):
+            var = variables.vars[i]
+            names[i] = var.name
+            _kinds[i] = var.type
+            if var.type == clib.VAR_TYPE_STRING:
+                _values[i] = NAN
+                exprs[i] = var.string
+            else:
+                _values[i] = clib.variable_value(var)
+                if var.expr is NULL:
+                    exprs[i] = NULL
+                else:
+                    exprs[i] = var.expr.string
+        rows = np.arange(num, dtype=np.intp)
+        data = {'name': _str_array(names, rows, False, False),
+                'expr': _str_array(exprs, rows, True, False)}
+    finally:
+        free(names)
+        free(exprs)
+    if as_unicode:
+        data['name'] = data['name'].astype('U')
+        data['expr'] = data['expr'].astype('U')
+    data['value'] = values
+    data['kind'] = np.array(_var_kinds)[kinds]
+    return data
+
+
+def get_dependency_graph():
+    """
+    Get the dependencies between global variables and element attributes.
+
+    :returns: mapping with the arrays ``name``, ``indptr`` and ``indices``
+    :rtype: dict
+
+    The graph is returned in compressed sparse row format: the direct
+    dependents of the node ``name[i]`` are ``name[indices[indptr[i]:
+    indptr[i+1]]]``. Nodes are global variables and element attributes
+    named ``element->attribute``. Only deferred expressions (``:=``) are
+    considered, since other expressions are evaluated only once.
+    """
+    cdef clib.var_list* variables = clib.variable_list
+    cdef clib.variable* var
+    cdef clib.element* elem
+    cdef clib.command* cmd
+    cdef clib.command_parameter* par
+    cdef clib.expression* item
+    cdef int i, j, k
+    names = []
+    index = {}
+    exprs = []
+    for i in range(variables.curr):
+        var = variables.vars[i]
+        name = _str(var.name)
+        index[name] = len(names)
+        names.append(name)
+        if (var.type == clib.VAR_TYPE_DEFERRED and var.expr is not NULL
+                and var.expr.string is not NULL):
+            exprs.append((name, _str(var.expr.string)))
+    for i in range(clib.element_list.curr):
+        elem = clib.element_list.elem[i]
+        cmd = elem.def_
+        for j in range(cmd.par.curr):
+            par = cmd.par.parameters[j]
+            target = '{}->{}'.format(_str(elem.name), _str(par.name))
+            if par.expr is not NULL and par.expr.string is not NULL:
+                exprs.append((target, _str(par.expr.string)))
+            # deferred array attributes, e.g. `knl:={0, kqf}`:
+            if par.expr_list is not NULL:
+                for k in range(par.expr_list.curr):
+                    item = par.expr_list.list[k]
+                    if item is not NULL and item.string is not NULL:
+                        exprs.append((target, _str(item.string)))
+    edges = set()
+    for target, expr in exprs:
+        for token in _identifier_re.findall(expr.lower()):
+            if token not in index and '->' not in token:
+                # function names, numbers etc:
+                continue
+            for name in (token, target):
+                if name not in index:
+                    index[name] = len(names)
+                    names.append(name)
+            edges.add((index[token], index[target]))
+    edges = sorted(edges)
+    sources = [source for source, target in edges]
+    targets = [target for source, target in edges]
+    sources = np.array(sources, dtype=np.int32)
+    targets = np.array(targets, dtype=np.int32)
+    order = np.argsort(sources, kind='mergesort')
+    counts = np.bincount(sources, minlength=len(names))
+    indptr = np.zeros(len(names) + 1, dtype=np.int32)
+    np.cumsum(counts, out=indptr[1:])
+    return {'name': np.array(names, dtype='U'),
+            'indptr': indptr,
+            'indices': targets[order]}
+
+
+def get_state_fingerprint(scope=None):
+    """
+    Compute a hash of the MAD-X state, e.g. as key for result caches.
+
+    :param list scope: parts of the state to be included, any of
+                       ``variables``, ``beam``, ``sequence``, ``elements``,
+                       ``errors`` (default: all)
+    :returns: hexadecimal SHA-1 digest
+    :rtype: str
+    :raises ValueError: if the scope is invalid
+
+    ``beam``, ``sequence`` and ``errors`` refer to the active sequence,
+    ``sequence`` covers the node names and positions of both the original
+    and the expanded sequence, ``elements`` the numeric attributes of all
+    element definitions. All data is hashed from contiguous arrays filled
+    in single passes over the MAD-X data structures.
+
+    The digests of ``beam``, ``sequence`` and ``errors`` are cached and only
+    recomputed when the version of the active sequence changes (see
+    :func:`get_sequence_version`).
+    """
+    if scope is None:
+        scope = _fingerprint_scopes
+    elif isinstance(scope, basestring):
+        scope = [scope]
+    for item in scope:
+        if item not in _fingerprint_scopes:
+            raise ValueError("Invalid scope: {!r}".format(item))
+    if clib.current_sequ is NULL:
+        sequence_name = None
+    else:
+        sequence_name = _str(clib.current_sequ.name)
+    digest = hashlib.sha1()
+    for item in _fingerprint_scopes:
+        if item in scope:
+            digest.update(_cstr(item))
+            digest.update(_scope_fingerprint(item, sequence_name))
+    return digest.hexdigest()
+
+
+def snapshot(elements=False):
+    """
+    Save the state of all global variables in the MAD-X process memory.
+
+    :param bool elements: also save the numeric attributes of all elements
+    :returns: snapshot id to be passed to :func:`restore`
+    :rtype: int
+
+    Values and expressions are copied in their internal representation,
+    i.e. nothing has to be parsed again on :func:`restore`. The snapshot is
+    kept until :func:`discard_snapshot` is called.
+    """
+    global _snapshot_counter
+    cdef clib.var_list* variables = clib.variable_list
+    cdef clib.variable* var
+    cdef clib.element* elem
+    cdef clib.command* cmd
+    cdef clib.command_parameter* par
+    cdef int i, j, k
+    saved_vars = []
+    for i in range(variables.curr):
+        var = variables.vars[i]
+        if var.type == clib.VAR_TYPE_STRING:
+            continue
+        saved_vars.append((<bytes> var.name, var.type, var.value,
+                           _clone_expression(var.expr)))
+    saved_elems = []
+    if elements:
+        for i in range(clib.element_list.curr):
+            elem = clib.element_list.elem[i]
+            cmd = elem.def_
+            params = []
+            for j in range(cmd.par.curr):
+                par = cmd.par.parameters[j]
+                if par.type in (clib.PARAM_TYPE_LOGICAL,
+                                clib.PARAM_TYPE_INTEGER,
+                                clib.PARAM_TYPE_DOUBLE):
+                    value = par.double_value
+                    expr = _clone_expression(par.expr)
+                elif par.type in (clib.PARAM_TYPE_LOGICAL_ARRAY,
+                                  clib.PARAM_TYPE_INTEGER_ARRAY,
+                                  clib.PARAM_TYPE_DOUBLE_ARRAY):
+                    # arrays are saved as lists of values and expressions:
+                    if par.double_array is NULL:
+                        continue
+                    value = [par.double_array.a[k]
+                             for k in range(par.double_array.curr)]
+                    expr = [
+                        _clone_expression(par.expr_list.list[k])
+                        if par.expr_list is not NULL and
+                        k < par.expr_list.curr else None
+                        for k in range(par.double_array.curr)]
+                else:
+                    continue
+                params.append((<bytes> par.name, value, expr,
+                               cmd.par_names.inform[j]))
+            saved_elems.append((<bytes> elem.name, params))
+    _snapshot_counter += 1
+    _snapshots[_snapshot_counter] = (saved_vars, saved_elems)
+    return _snapshot_counter
+
+
+def restore(snapshot_id):
+    """
+    Restore the state of variables (and elements) saved by :func:`snapshot`.
+
+    :param int snapshot_id: id returned by :func:`snapshot`
+    :raises KeyError: if the snapshot does not exist
+
+    Variables and elements that were defined after the snapshot was taken
+    are left unchanged. The snapshot is kept and can be restored again.
+    """
+    saved_vars, saved_elems = _snapshots[snapshot_id]
+    cdef clib.variable* var
+    cdef clib.element* elem
+    cdef clib.command_parameter* par
+    cdef _ParsedExpression expr
+    cdef bytes _name
+    cdef int pos
+    for _name, kind, value, expr in saved_vars:
+        var = clib.find_variable(_name, clib.variable_list)
+        if var is NULL or var.type == clib.VAR_TYPE_STRING:
+            continue
+        if var.expr is not NULL:
+            var.expr = clib.delete_expression(var.expr)
+        if expr is not None:
+            var.expr = clib.clone_expression(expr.expr)
+        var.type = kind
+        var.value = value
+    for _name, params in saved_elems:
+        elem = clib.find_element(_name, clib.element_list)
+        if elem is NULL:
+            continue
+        for _attr, value, saved_expr, inform in params:
+            pos = clib.name_list_pos(_attr, elem.def_.par_names)
+            if pos == -1:
+                continue
+            par = elem.def_.par.parameters[pos]
+            if isinstance(value, list):
+                _restore_array(par, value, saved_expr)
+            else:
+                if par.expr is not NULL:
+                    par.expr = clib.delete_expression(par.expr)
+                if saved_expr is not None:
+                    expr = saved_expr
+                    par.expr = clib.clone_expression(expr.expr)
+                par.double_value = value
+            elem.def_.par_names.inform[pos] = inform
+            if _attr == b'l':
+                elem.length = _get_param_double(par)
+    if saved_vars or saved_elems:
+        _bump_versions(_sequence_versions, _sequence_names())
+
+
+def discard_snapshot(snapshot_id):
+    """
+    Free the memory of a snapshot.
+
+    :param int snapshot_id: id returned by :func:`snapshot`
+    :raises KeyError: if the snapshot does not exist
+    """
+    del _snapshots[snapshot_id]
+
+
+def set_element_attributes(names, attribute, values, sequence_name=None):
+    """
+    Set a numeric attribute for many elements at once.
+
+    :param list names: element names, occurence counts of node names (as in
+                       ``qf:1``) are ignored
+    :param str attribute: attribute name, e.g. ``k1``
+    :param values: array of values or a single value for all elements
+    :param str sequence_name: if given, all elements must be used in this
+                              sequence
+    :raises ValueError: if an element or attribute is invalid
+
+    The parameters of the element definitions are written directly. Any
+    expression previously assigned to the attribute is removed, just as for
+    the MAD-X statement ``name->attribute = value;``. Nothing is changed if
+    an error occurs. Changing the length of elements in an already expanded
+    sequence requires another USE to take effect.
+    """
+    cdef int i, num = len(names)
+    cdef bytes _name
+    cdef bytes _attr = _cstr(attribute.lower())
+    cdef clib.element* elem
+    cdef clib.command_parameter* par
+    if sequence_name is None:
+        members = None
+    else:
+        members = _sequence_element_names(_find_sequence(sequence_name))
+    _values = np.empty(num)
+    _values[:] = values
+    cdef double[::1] _data = _values
+    # allocate one more entry to avoid zero-size allocations:
+    cdef clib.element** elems = <clib.element**> malloc(
+        (num + 1) * sizeof(clib.element*))
+    cdef int* positions = <int*> malloc((num + 1) * sizeof(int))
+    if elems is NULL or positions is NULL:
+        free(elems)
+        free(positions)
+        raise MemoryError
+    try:
+        # validate everything before making any changes:
+        for i, name in enumerate(names):
+            _name = _cstr(name.lower().split(':')[0])
+            elem = clib.find_element(_name, clib.element_list)
+            if elem is NULL:
+                raise ValueError("Invalid element: {!r}".format(name))
+            if members is not None and _str(elem.name) not in members:
+                raise ValueError("Element {!r} is not in sequence {!r}."
+                                 .format(name, sequence_name))
+            positions[i] = clib.name_list_pos(_attr, elem.def_.par_names)
+            if positions[i] == -1:
+                raise ValueError("Element {!r} has no attribute {!r}."
+                                 .format(name, attribute))
+            par = elem.def_.par.parameters[positions[i]]
+            if par.type not in (clib.PARAM_TYPE_LOGICAL,
+                                clib.PARAM_TYPE_INTEGER,
+                                clib.PARAM_TYPE_DOUBLE):
+                raise ValueError("Attribute {!r} is not numeric."
+                                 .format(attribute))
+            elems[i] = elem
+        for i in range(num):
+            elem = elems[i]
+            par = elem.def_.par.parameters[positions[i]]
+            if par.expr is not NULL:
+                par.expr = clib.delete_expression(par.expr)
+            par.double_value = _data[i]
+            # mark as explicitly set:
+            elem.def_.par_names.inform[positions[i]] = 1
+            if _attr == b'l':
+                elem.length = _data[i]
+    finally:
+        free(elems)
+        free(positions)
+    # element definitions can be shared between sequences:
+    _bump_versions(_sequence_versions, _sequence_names())
+
+
+def assign_errors(sequence_name, names, align=None, knl=None, ksl=None):
+    """
+    Assign alignment and field errors to nodes of an expanded sequence.
+
+    :param str sequence_name: sequence name
+    :param list names: node names (``qf:1``) or element names (applies to all
+                       nodes of the element)
+    :param dict align: ``{component: values}`` for the EALIGN components
+                       ``dx``, ``dy``, ``ds``, ``dphi``, ``dtheta``, ``dpsi``,
+                       ``mrex``, ``mrey``, ``mredx``, ``mredy``, ``arex``,
+                       ``arey``, ``mscalx``, ``mscaly``
+    :param knl: 2D array ``(len(names), order)`` of absolute normal field
+                errors (as EFCOMP ``dknl``)
+    :param ksl: 2D array ``(len(names), order)`` of absolute skew field
+                errors (as EFCOMP ``dksl``)
+    :raises ValueError: if the sequence is not expanded or a name or
+                        component is invalid
+
+    Components that are not passed keep their previous value. Nothing is
+    changed if an error occurs.
+    """
+    cdef clib.sequence* seq = _find_sequence(sequence_name)
+    if seq.all_nodes is NULL:
+        raise ValueError("Sequence {!r} is not expanded."
+                         .format(sequence_name))
+    cdef int i, j, k, num = len(names)
+    cdef int num_align = min(len(_align_columns), clib.ALIGN_MAX)
+    cdef clib.node* node
+    # validate everything before making any changes:
+    align_values = np.zeros((num_align, num))
+    align_given = np.zeros(num_align, dtype=np.uint8)
+    for key, value in (align or {}).items():
+        try:
+            j = _align_columns.index(key.lower())
+        except ValueError:
+            j = num_align
+        if j >= num_align:
+            raise ValueError("Invalid alignment error: {!r}".format(key))
+        align_values[j, :] = value
+        align_given[j] = 1
+    if num == 0:
+        return
+    fields = []
+    for values in (knl, ksl):
+        if values is None:
+            values = np.zeros((num, 0))
+        else:
+            values = np.array(values, dtype=np.float64).reshape(num, -1)
+        if values.shape[1] > clib.FIELD_MAX // 2:
+            raise ValueError("Field errors are limited to order {}."
+                             .format(clib.FIELD_MAX // 2 - 1))
+        fields.append(values)
+    index = {}
+    for k in range(seq.n_nodes):
+        node = seq.all_nodes[k]
+        index.setdefault(_str(node.name), []).append(k)
+        if node.p_elem is not NULL:
+            index.setdefault(_str(node.p_elem.name), []).append(k)
+    try:
+        positions = [index[name.lower()] for name in names]
+    except KeyError as e:
+        raise ValueError("Invalid node: {!r}".format(e.args[0]))
+    cdef double[:, ::1] _align = align_values
+    cdef unsigned char[::1] _given = align_given
+    cdef double[:, ::1] _knl = fields[0]
+    cdef double[:, ::1] _ksl = fields[1]
+    cdef bint has_align = align_given.any()
+    cdef bint has_field = _knl.shape[1] > 0 or _ksl.shape[1] > 0
+    for i, nodes in enumerate(positions):
+        for k in nodes:
+            node = seq.all_nodes[k]
+            if has_align:
+                if node.p_al_err is NULL:
+                    node.p_al_err = _new_double_array(clib.ALIGN_MAX)
+                for j in range(num_align):
+                    if _given[j]:
+                        node.p_al_err.a[j] = _align[j, i]
+            if has_field:
+                if node.p_fd_err is NULL:
+                    node.p_fd_err = _new_double_array(clib.FIELD_MAX)
+                # normal and skew components are stored interleaved:
+                for j in range(_knl.shape[1]):
+                    node.p_fd_err.a[2*j] = _knl[i, j]
+                for j in range(_ksl.shape[1]):
+                    node.p_fd_err.a[2*j+1] = _ksl[i, j]
+    _bump_versions(_sequence_versions, [sequence_name])
+
+
+def get_errors(sequence_name, as_unicode=False):
+    """
+    Get the alignment and field errors of an expanded sequence.
+
+    :param str sequence_name: sequence name
+    :param bool as_unicode: return the name column with unicode (``U``)
+                            instead of bytes (``S``) dtype
+    :returns: mapping ``{column: array}`` with one row for each node that
+              has errors assigned
+    :rtype: dict
+    :raises ValueError: if the sequence is invalid
+
+    The columns are the same as in the table written by ESAVE: ``name``,
+    ``k0l``, ``k0sl``, ..., ``k20l``, ``k20sl`` and the alignment errors
+    ``dx``, ``dy``, ``ds``, ``dphi``, etc.
+    """
+    cdef clib.sequence* seq = _find_sequence(sequence_name)
+    cdef int i, j, num = 0
+    cdef int num_nodes = seq.n_nodes if seq.all_nodes is not NULL else 0
+    cdef clib.node* node
+    rows = np.zeros(num_nodes, dtype=np.intp)
+    cdef Py_ssize_t[::1] _rows = rows
+    for i in range(num_nodes):
+        node = seq.all_nodes[i]
+        if node.p_al_err is not NULL or node.p_fd_err is not NULL:
+            _rows[num] = i
+            num += 1
+    rows = rows[:num]
+    _rows = rows
+    field = np.zeros((num, clib.FIELD_MAX))
+    align = np.zeros((num, clib.ALIGN_MAX))
+    cdef double[:, ::1] _field = field
+    cdef double[:, ::1] _align = align
+    # allocate one more entry to avoid zero-size allocations:
+    cdef char** names = <char**> malloc((num_nodes + 1) * sizeof(char*))
+    if names is NULL:
+        raise MemoryError
+    try:
+        for i in range(num_nodes):
+            names[i] = seq.all_nodes[i].name
+        for i in range(num):
+            node = seq.all_nodes[_rows[i]]
+            if node.p_al_err is not NULL:
+                for j in range(min(node.p_al_err.curr, clib.ALIGN_MAX)):
+                    _align[i, j] = node.p_al_err.a[j]
+            if node.p_fd_err is not NULL:
+                for j in range(min(node.p_fd_err.curr, clib.FIELD_MAX)):
+                    _field[i, j] = node.p_fd_err.a[j]
+        data = {'name': _str_array(names, rows, False, False)}
+    finally:
+        free(names)
+    if as_unicode:
+        data['name'] = data['name'].astype('U')
+    for j in range(clib.FIELD_MAX // 2):
+        data['k{}l'.format(j)] = field[:, 2*j]
+        data['k{}sl'.format(j)] = field[:, 2*j+1]
+    for j, column in enumerate(_align_columns):
+        data[column] = align[:, j]
+    return data
+
+
+def get_track_data(turns, num_particles, num_observe):
+    """
+    Collect the results of TRACK into a single array.
+
+    :param int turns: number of tracked turns
+    :param int num_particles: number of tracked particles
+    :param int num_observe: number of observation points (including the
+                            start of the sequence)
+    :returns: array ``(turns+1, num_observe, num_particles, 6)``
+    :rtype: numpy.ndarray
+
+    The coordinates are read from the ``track.obsNNNN.pNNNN`` tables. The
+    first index of the result is the turn number (0 for the start
+    coordinates), the second index refers to the observation points in the
+    order of the OBSERVE commands, preceded by the start of the sequence.
+    Coordinates are NaN after a particle is lost.
+    """
+    cdef int i, j
+    cdef clib.table* _table
+    result = np.empty((turns + 1, num_observe, num_particles, 6))
+    result.fill(np.nan)
+    for j in range(num_observe):
+        for i in range(num_particles):
+            name = 'track.obs{:04d}.p{:04d}'.format(j + 1, i + 1)
+            if not table_exists(name):
+                continue
+            _table = _find_table(name)
+            turn = _get_column(_table, 'turn', None,
+                               False, False, False).astype(np.intp)
+            valid = turn <= turns
+            for k, column in enumerate(_track_columns):
+                data = _get_column(_table, column, None, False, False, False)
+                result[turn[valid], j, i, k] = data[valid]
+    return result
+
+
+# Helper functions:
+
+# The following functions are `cdef functions`, i.e. they can only be
+# called from Cython code. It is necessary to use `cdef functions` whenever
+# we want to pass parameters or return values with a pure C type.
+
+cdef class _ParsedExpression:
+
+    """Owns a MAD-X expression and deletes it on finalization."""
+
+    cdef clib.expression* expr
+
+    def __dealloc__(self):
+        if self.expr is not NULL:
+            clib.delete_expression(self.expr)
+
+
+cdef _ParsedExpression _parse_expression(cmd):
+    """
+    Get the parsed expression for the expression string from the cache.
+
+    :param str cmd: symbolic expression
+    :raises ValueError: if the expression can not be parsed
+    """
+    global _expr_cache_hits, _expr_cache_misses
+    cdef _ParsedExpression parsed
+    # Whitespace is insignificant in MAD-X expressions:
+    key = ''.join(cmd.lower().split())
+    parsed = _expr_cache.pop(key, None)
+    if parsed is None:
+        _expr_cache_misses += 1
+        parsed = _ParsedExpression()
+        parsed.expr = _make_expression(key)
+    else:
+        _expr_cache_hits += 1
+    # (re-)insert as most recently used entry:
+    if _expr_cache_maxsize > 0:
+        _expr_cache[key] = parsed
+        if len(_expr_cache) > _expr_cache_maxsize:
+            _expr_cache.popitem(last=False)
+    return parsed
+
+
+cdef _ParsedExpression _clone_expression(clib.expression* expr):
+    """Return an owned copy of the expression (or None if NULL)."""
+    if expr is NULL:
+        return None
+    cdef _ParsedExpression clone = _ParsedExpression()
+    clone.expr = clib.clone_expression(expr)
+    return clone
+
+
+cdef clib.expression* _make_expression(cmd) except NULL:
+    """
+    Parse an expression string into a new MAD-X expression.
+
     NOTE: This function uses global variables as temporaries - which is in
     general an *extremely* bad design choice. Even though MAD-X uses global
     variables internally anyway, we should probably change this at some
     time.
     """
-    # TODO: not sure about the flags (the magic constants 0, 2)
-    cdef bytes _cmd = _cstr(cmd.lower())
+    # TODO: not sure about the flags (the magic constant 0)
+    cdef bytes _cmd = _cstr(cmd)
     clib.pre_split(_cmd, clib.c_dum, 0)
     clib.mysplit(clib.c_dum.c, clib.tmp_p_array)
-    expr = clib.make_expression(clib.tmp_p_array.curr, clib.tmp_p_array.p)
-    value = clib.expression_value(expr, 2)
-    clib.delete_expression(expr)
-    return value
+    cdef clib.expression* expr = clib.make_expression(
+        clib.tmp_p_array.curr, clib.tmp_p_array.p)
+    if expr is NULL:
+        raise ValueError("Invalid expression: {!r}".format(cmd))
+    return expr
 
 
-# Helper functions:
+_expr_types = [bool, int, float]
 
-# The following functions are `cdef functions`, i.e. they can only be
-# called from Cython code. It is necessary to use `cdef functions` whenever
-# we want to pass parameters or return values with a pure C type.
+# names of the variable types, indexed by `VAR_TYPE_*`:
+_var_kinds = ['constant', 'direct', 'deferred', 'string']
+
+# identifiers in expressions, including `element->attribute` references:
+_identifier_re = re.compile(
+    r'(?<![\w.$])[a-z_][a-z0-9_.$]*(?:->[a-z_][a-z0-9_]*)?')
+
+# parts of the state that can be included in `get_state_fingerprint()`:
+_fingerprint_scopes = ['variables', 'beam', 'sequence', 'elements', 'errors']
+
+# scopes that change only along with the version of the active sequence:
+_fingerprint_cached_scopes = frozenset(['beam', 'sequence', 'errors'])
+
+# command name of a statement (after an optional label):
+_command_re = re.compile(r'(?:[\w.$]+\s*:(?!=))?\s*([\w.$]+)')
+
+# assignment to a variable or element attribute (no table is modified):
+_assign_re = re.compile(
+    r'(?:(?:const|real|int|shared)\s+)*'
+    r'[\w.$]+(?:->[\w.$]+)?(?:\[\d+\])?\s*:?=')
+
+# MAD-X comments (/* */ blocks and line comments starting with ! or //):
+_comment_re = re.compile(r'/\*.*?\*/|(?:!|//)[^\n]*', re.DOTALL)
+
+# phase space coordinates in the order used by TRACK:
+_track_columns = ['x', 'px', 'y', 'py', 't', 'pt']
+
+# components of alignment errors in the order used by MAD-X (EALIGN):
+_align_columns = ['dx', 'dy', 'ds', 'dphi', 'dtheta', 'dpsi',
+                  'mrex', 'mrey', 'mredx', 'mredy',
+                  'arex', 'arey', 'mscalx', 'mscaly']
 
-_expr_types = [bool, int, float]
 
 cdef _expr(clib.expression* expr,
            double value,
-           int typeid=clib.PARAM_TYPE_DOUBLE):
-    """Return a parameter value with an appropriate type."""
+           int typeid=clib.PARAM_TYPE_DOUBLE,
+           bint lazy=False):
+    """
+    Return a parameter value with an appropriate type.
+
+    If ``lazy`` is true, symbolic expressions are not evaluated. The value
+    last computed by MAD-X (``expr.value``, updated by every evaluation, e.g.
+    during TWISS) is used instead.
+    """
     _type = _expr_types[typeid]
     _value = _type(value)
     if expr is NULL or expr.string is NULL:
@@ -384,10 +1537,23 @@ cdef _expr(clib.expression* expr,
         return _type(float(_expr))
     except ValueError:
         pass
+    if lazy:
+        return Expression(_expr, _type(expr.value), _type)
     return Expression(_expr, _type(evaluate(_expr)), _type)
 
 
-cdef _get_param_value(clib.command_parameter* par):
+cdef double _get_param_double(clib.command_parameter* par):
+    """Get the current numeric value of a command parameter (or NaN)."""
+    if par.type in (clib.PARAM_TYPE_LOGICAL,
+                    clib.PARAM_TYPE_INTEGER,
+                    clib.PARAM_TYPE_DOUBLE):
+        if par.expr is not NULL:
+            return clib.expression_value(par.expr, 2)
+        return par.double_value
+    return NAN
+
+
+cdef _get_param_value(clib.command_parameter* par, bint lazy=False):
 
     """
     Get the value of a command parameter.
@@ -400,27 +1566,32 @@ cdef _get_param_value(clib.command_parameter* par):
     if par.type in (clib.PARAM_TYPE_LOGICAL,
                     clib.PARAM_TYPE_INTEGER,
                     clib.PARAM_TYPE_DOUBLE):
-        return _expr(par.expr, par.double_value, par.type)
+        return _expr(par.expr, par.double_value, par.type, lazy)
 
     if par.type == clib.PARAM_TYPE_STRING:
         return _str(par.string)
 
     if par.type == clib.PARAM_TYPE_CONSTRAINT:
         if par.c_type == clib.CONSTR_TYPE_MIN:
-            return Constraint(min=_expr(par.min_expr, par.c_min))
+            return Constraint(
+                min=_expr(par.min_expr, par.c_min, lazy=lazy))
         if par.c_type == clib.CONSTR_TYPE_MAX:
-            return Constraint(max=_expr(par.max_expr, par.c_max))
+            return Constraint(
+                max=_expr(par.max_expr, par.c_max, lazy=lazy))
         if par.c_type == clib.CONSTR_TYPE_BOTH:
-            return Constraint(min=_expr(par.min_expr, par.c_min),
-                              max=_expr(par.max_expr, par.c_max))
+            return Constraint(
+                min=_expr(par.min_expr, par.c_min, lazy=lazy),
+                max=_expr(par.max_expr, par.c_max, lazy=lazy))
         if par.c_type == clib.CONSTR_TYPE_VALUE:
-            return Constraint(val=_expr(par.expr, par.double_value))
+            return Constraint(
+                val=_expr(par.expr, par.double_value, lazy=lazy))
 
     if par.type in (clib.PARAM_TYPE_INTEGER_ARRAY, clib.PARAM_TYPE_DOUBLE_ARRAY):
         return [
             _expr(NULL if par.expr_list is NULL else par.expr_list.list[i],
                   par.double_array.a[i],
-                  par.type - clib.PARAM_TYPE_LOGICAL_ARRAY)
+                  par.type - clib.PARAM_TYPE_LOGICAL_ARRAY,
+                  lazy)
             for i in xrange(par.double_array.curr)
         ]
 
@@ -431,10 +1602,12 @@ cdef _get_param_value(clib.command_parameter* par):
     raise ValueError("Unknown parameter type: {}".format(par.type))
 
 
-cdef _parse_command(clib.command* cmd):
+cdef _parse_command(clib.command* cmd, bint lazy=False, bint sparse=False):
     """
     Get the values of all parameters of a command.
 
+    :param lazy: do not evaluate expressions
+    :param sparse: skip parameters that were not explicitly set
     :returns: the command parameters
     :rtype: dict
     """
@@ -443,11 +1616,74 @@ cdef _parse_command(clib.command* cmd):
     res = {}
     cdef int i
     for i in xrange(cmd.par.curr):
+        if (sparse and not cmd.par_names.inform[i]
+                and cmd.par.parameters[i].expr is NULL):
+            continue
         name = _str(cmd.par.parameters[i].name)
-        res[name] = _get_param_value(cmd.par.parameters[i])
+        res[name] = _get_param_value(cmd.par.parameters[i], lazy)
     return res
 
 
+cdef _input_effects(cmd):
+    """
+    Check whether the input may modify tables or sequences.
+
+    :returns: tuple ``(tables, sequences)`` of booleans
+
+    This is a conservative classification based on the command names:
+    assignments may change element attributes (and hence sequences), but
+    not tables. All other commands except for a few read-only ones are
+    assumed to modify both.
+    """
+    tables = sequences = False
+    for statement in _comment_re.sub('', cmd).split(';'):
+        statement = statement.strip().lower()
+        if not statement:
+            continue
+        match = _command_re.match(statement)
+        if match is not None and match.group(1) in _readonly_commands:
+            continue
+        sequences = True
+        if not _assign_re.match(statement):
+            return True, True
+    return tables, sequences
+
+
+cdef _table_names():
+    """Get the names of all tables."""
+    cdef int i
+    return [_str(clib.table_register.tables[i].name)
+            for i in xrange(clib.table_register.curr)]
+
+
+cdef _sequence_names():
+    """Get the names of all sequences."""
+    cdef int i
+    cdef clib.sequence_list* seqs = clib.madextern_get_sequence_list()
+    return [_str(seqs.sequs[i].name) for i in xrange(seqs.curr)]
+
+
+cdef _sequence_element_names(clib.sequence* seq):
+    """Get the names of all element definitions used in the sequence."""
+    cdef int i
+    names = {_str(seq.nodes.nodes[i].p_elem.name)
+             for i in xrange(seq.nodes.curr)
+             if seq.nodes.nodes[i].p_elem is not NULL}
+    if seq.all_nodes is not NULL:
+        names.update(_str(seq.all_nodes[i].p_elem.name)
+                     for i in xrange(seq.n_nodes)
+                     if seq.all_nodes[i].p_elem is not NULL)
+    return names
+
+
+cdef _bump_versions(versions, names):
+    """Increase the change counters of the given tables or sequences."""
+    # Versions of deleted objects are kept so they continue to increase
+    # monotonically if the objects are re-created:
+    for name in names:
+        versions[name] = versions.get(name, 0) + 1
+
+
 # The 'except NULL' clause is needed to forward exceptions from cdef
 # functions with C return values, see:
 # http://docs.cython.org/src/userguide/language_basics.html#error-return-values
@@ -466,6 +1702,145 @@ cdef clib.sequence* _find_sequence(sequence_name) except NULL:
     return seqs.sequs[index]
 
 
+cdef clib.table* _find_table(table) except NULL:
+    """
+    Get pointer to the C table struct of the specified table.
+
+    :param str table: table name
+    :raises ValueError: if the table can not be found
+    """
+    cdef bytes _table_name = _cstr(table)
+    cdef int index = clib.name_list_pos(_table_name, clib.table_register.names)
+    if index == -1:
+        raise ValueError("Invalid table: {!r}".format(table))
+    return clib.table_register.tables[index]
+
+
+cdef _get_column(clib.table* _table, column, rows,
+                 bint strip, bint lower, bint as_unicode,
+                 bint categorical=False):
+    """
+    Get data from the specified table column.
+
+    :param rows: array of row indices or ``None`` for all rows
+
+    See :func:`get_table_column` for details.
+    """
+    cdef char** char_tmp
+    cdef bytes _col_name = _cstr(column)
+    cdef clib.column_info info
+    # The following snippet imitates the table_get_column function from the
+    # C API of the MAD-X library. The replacement is needed for proper
+    # handling of integer columns for as long as we support versions of
+    # MAD-X before r4777. When this is not the case anymore, you should be
+    # able to safely revert the commit that introduced this snippet:
+    cdef int col_i = clib.name_list_pos(_col_name, _table.columns)
+    if col_i == -1:
+        raise ValueError("Invalid column: {!r}".format(column))
+    info.length = _table.curr
+    cdef int inform = _table.columns.inform[col_i]
+    if inform == clib.PARAM_TYPE_INTEGER:
+        # YES, integers are internally stored as doubles in MAD-X:
+        info.data = _table.d_cols[col_i]
+        info.datatype = b'i'
+    elif inform == clib.PARAM_TYPE_DOUBLE:
+        info.data = _table.d_cols[col_i]
+        info.datatype = b'd'
+    elif inform == clib.PARAM_TYPE_STRING:
+        info.data = _table.s_cols[col_i]
+        info.datatype = b'S'
+    else:
+        raise RuntimeError("Unknown column format: {!r}".format(inform))
+    # Although, we are using a custom replacement for table_get_column
+    # above, we still try to be fully compatible with the real function from
+    # MAD-X below, so back-migration will be easier, when the time comes.
+    # This is why the error and data type handling below is left untouched:
+    dtype = <bytes> info.datatype
+    size = <int> info.length
+    addr = <Py_intptr_t> info.data
+    # double:
+    if dtype == b'i' or dtype == b'd':
+        # YES, integers are internally stored as doubles in MAD-X:
+        array_type = ctypes.c_double * size
+        array_data = array_type.from_address(addr)
+        data = np.ctypeslib.as_array(array_data)
+        return data if rows is None else data[rows]
+    # string:
+    elif dtype == b'S':
+        char_tmp = <char**> info.data
+        if rows is None:
+            rows = np.arange(size, dtype=np.intp)
+        data = _str_array(char_tmp, rows, strip, lower)
+        if categorical:
+            categories, codes = np.unique(data, return_inverse=True)
+            if as_unicode:
+                categories = categories.astype('U')
+            return Categorical(categories, codes.astype(np.int32))
+        return data.astype('U') if as_unicode else data
+    # invalid:
+    elif dtype == b'V':
+        raise ValueError("Column {!r} is not in table {!r}."
+                         .format(column, _str(_table.name)))
+    # unknown:
+    else:
+        raise RuntimeError("Unknown datatype {!r} in column {!r}."
+                           .format(_str(dtype), column))
+
+
+cdef _select_rows(clib.table* _table, rows):
+    """
+    Get the indices of the selected table rows.
+
+    :param rows: row selection, see :func:`get_table_column`
+    :returns: array of row indices or ``None`` if all rows are selected
+    :raises IndexError: if a row index is out of range
+    """
+    cdef int num = _table.curr
+    if rows is None:
+        return None
+    if isinstance(rows, slice):
+        return np.arange(*rows.indices(num), dtype=np.intp)
+    if isinstance(rows, RowFilter):
+        mask = np.ones(num, dtype=bool)
+        if rows.name is not None:
+            match = re.compile(rows.name, re.IGNORECASE).match
+            names = _get_column(_table, 'name', None, False, False, True)
+            mask &= np.array([bool(match(name)) for name in names],
+                             dtype=bool)
+        if rows.keyword is not None:
+            keywords = rows.keyword
+            if isinstance(keywords, basestring):
+                keywords = [keywords]
+            keywords = [keyword.lower() for keyword in keywords]
+            column = _get_column(_table, 'keyword', None, True, True, True)
+            mask &= np.isin(column, keywords)
+        if rows.s is not None:
+            s_min, s_max = rows.s
+            column = _get_column(_table, 's', None, False, False, False)
+            if s_min is not None:
+                mask &= column >= s_min
+            if s_max is not None:
+                mask &= column <= s_max
+        return np.flatnonzero(mask).astype(np.intp)
+    rows = np.asarray(rows)
+    if rows.dtype == bool:
+        if len(rows) != num:
+            raise IndexError("Row mask has invalid length: {}".format(len(rows)))
+        return np.flatnonzero(rows).astype(np.intp)
+    rows = rows.astype(np.intp).ravel()
+    rows[rows < 0] += num
+    if np.any((rows < 0) | (rows >= num)):
+        raise IndexError("Row index out of range.")
+    return rows
+
+
+cdef _get_summary(clib.char_p_array* header):
+    """Parse all table header lines into a dict."""
+    cdef int i
+    return dict([_split_header_line(header.p[i])
+                 for i in xrange(header.curr)])
+
+
 cdef _split_header_line(header_line):
     """Parse a table header value."""
     _, key, kind, value = _str(header_line).split(None, 3)
@@ -477,10 +1852,64 @@ cdef _split_header_line(header_line):
         return key, value           #
 
 
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef _str_array(char** data, Py_ssize_t[::1] rows, bint strip, bint lower):
+    """
+    Copy C strings into a fixed-width bytes array.
+
+    :param data: C string array
+    :param rows: indices of the strings to be copied
+    :param strip: strip surrounding whitespace
+    :param lower: convert to lowercase
+    :returns: numpy array with ``S`` dtype and one entry per row
+    """
+    cdef Py_ssize_t num = rows.shape[0]
+    cdef Py_ssize_t i, j, begin, end, width = 1
+    cdef char* s
+    # Determine string boundaries and the maximum width in a first pass:
+    offsets = np.zeros(num, dtype=np.intp)
+    lengths = np.zeros(num, dtype=np.intp)
+    cdef Py_ssize_t[::1] _offsets = offsets
+    cdef Py_ssize_t[::1] _lengths = lengths
+    with nogil:
+        for i in range(num):
+            s = data[rows[i]]
+            if s is NULL:
+                continue
+            begin = 0
+            end = strlen(s)
+            if strip:
+                # <ctype.h> functions are undefined for negative values
+                # other than EOF, i.e. for non-ASCII bytes in signed chars:
+                while begin < end and isspace(<unsigned char> s[begin]):
+                    begin += 1
+                while end > begin and isspace(<unsigned char> s[end-1]):
+                    end -= 1
+            _offsets[i] = begin
+            _lengths[i] = end - begin
+            if end - begin > width:
+                width = end - begin
+    # Fill the preallocated (zero padded) buffer in a second pass:
+    buf = np.zeros(num * width, dtype=np.uint8)
+    cdef unsigned char[::1] _buf = buf
+    with nogil:
+        for i in range(num):
+            if _lengths[i] == 0:
+                continue
+            s = data[rows[i]] + _offsets[i]
+            memcpy(&_buf[i*width], s, _lengths[i])
+            if lower:
+                # _buf is unsigned, so tolower gets valid arguments:
+                for j in range(i*width, i*width + _lengths[i]):
+                    _buf[j] = tolower(_buf[j])
+    return buf.view('S{}'.format(width))
+
+
 cdef _name_list(clib.name_list* names):
     """Return a python list of names for the name_list."""
     cdef int i
-    return [names.names[i] for i in xrange(names.curr)]
+    return [_str(names.names[i]) for i in xrange(names.curr)]
 
 
 cdef _str(char* s):
@@ -499,24 +1928,192 @@ cdef bytes _cstr(s):
     return <bytes> s.encode('utf-8')
 
 
-cdef _get_node(clib.node* node, int ref_flag):
+cdef _get_node(clib.node* node, int ref_flag,
+               bint lazy=False, bint sparse=False):
     """Return dictionary with node + element attributes."""
     if node.p_elem is NULL:
         # Maybe this is a valid case, but better detect it with boom!
         raise RuntimeError("Empty node or subsequence! Please report this incident!")
-    # normalize 'at' value to node entry:
+    data = _get_element(node.p_elem, lazy, sparse)
+    data.update({'name': _str(node.name),
+                 'type': _str(node.base_name),
+                 'at': _node_at(node, ref_flag)})
+    return data
+
+
+cdef double _node_at(clib.node* node, int ref_flag):
+    """Return the 'at' value of the node normalized to the node entry."""
     cdef double at = node.at_value
     if ref_flag == clib.REF_CENTER:
         at -= node.length / 2
     elif ref_flag == clib.REF_EXIT:
         at -= node.length
-    data = _get_element(node.p_elem)
-    data.update({'name': _str(node.name),
-                 'type': _str(node.base_name),
-                 'at': at})
-    return data
+    return at
 
 
-cdef _get_element(clib.element* elem):
+cdef _get_element(clib.element* elem, bint lazy=False, bint sparse=False):
     """Return dictionary with element attributes."""
-    return _parse_command(elem.def_)
+    return _parse_command(elem.def_, lazy, sparse)
+
+
+cdef _restore_array(clib.command_parameter* par, values, exprs):
+    """Replace values and expressions of an array parameter."""
+    cdef int k, num = len(values)
+    cdef _ParsedExpression expr
+    if par.double_array is not NULL:
+        par.double_array = clib.delete_double_array(par.double_array)
+    if par.expr_list is not NULL:
+        par.expr_list = clib.delete_expr_list(par.expr_list)
+    par.double_array = _new_double_array(num)
+    for k in range(num):
+        par.double_array.a[k] = values[k]
+    if any(item is not None for item in exprs):
+        par.expr_list = clib.new_expr_list(num)
+        for k in range(num):
+            expr = exprs[k]
+            par.expr_list.list[k] = (NULL if expr is None else
+                                     clib.clone_expression(expr.expr))
+        par.expr_list.curr = num
+
+
+cdef clib.double_array* _new_double_array(int size):
+    """Allocate a zero-initialized double array with the given length."""
+    cdef clib.double_array* array = clib.new_double_array(size)
+    cdef int i
+    for i in range(size):
+        array.a[i] = 0
+    array.curr = size
+    return array
+
+
+cdef bytes _scope_fingerprint(item, sequence_name):
+    """Get the digest of one part of the MAD-X state, cached if possible."""
+    key = (sequence_name, _sequence_versions.get(sequence_name, 0))
+    cached = item in _fingerprint_cached_scopes
+    if cached:
+        entry = _fingerprint_cache.get(item)
+        if entry is not None and entry[0] == key:
+            return entry[1]
+    digest = hashlib.sha1()
+    _update_fingerprint(digest, item, sequence_name)
+    result = digest.digest()
+    if cached:
+        _fingerprint_cache[item] = (key, result)
+    return result
+
+
+cdef _update_fingerprint(digest, item, sequence_name):
+    """Feed the data of one part of the MAD-X state into the hash."""
+    if item == 'variables':
+        data = get_globals()
+        # Only deferred expressions (and strings) are part of the state. The
+        # expressions of direct assignments were evaluated once and are not
+        # kept by all means of assignment (`x = 2;` vs set_variables):
+        data['expr'][~np.isin(data['kind'], ['deferred', 'string'])] = b''
+        columns = ['name', 'value', 'expr']
+    elif item == 'elements':
+        _hash_elements(digest)
+        return
+    elif sequence_name is None:
+        return
+    elif item == 'beam':
+        try:
+            beam = get_beam(sequence_name)
+        except RuntimeError:
+            return
+        digest.update(_cstr(repr(sorted(beam.items()))))
+        return
+    elif item == 'sequence':
+        digest.update(_cstr(sequence_name))
+        for expanded in (False, True):
+            data = get_element_table(sequence_name, expanded=expanded)
+            for column in ('name', 'at', 'l'):
+                digest.update(np.ascontiguousarray(data[column]))
+        return
+    elif item == 'errors':
+        data = get_errors(sequence_name)
+        columns = sorted(data)
+    for column in columns:
+        digest.update(np.ascontiguousarray(data[column]))
+
+
+cdef _table_column_data(name, values):
+    """
+    Convert column values for :func:`create_table`.
+
+    :returns: list of bytes for string columns, float64 array otherwise
+    :raises TypeError: if a value can not be converted
+    """
+    if values.dtype.kind not in 'SUO':
+        try:
+            return np.ascontiguousarray(values, dtype=np.float64)
+        except (TypeError, ValueError):
+            raise TypeError("Invalid values in column {!r}".format(name))
+    result = []
+    for value in values:
+        # `bytes(value)` also converts numpy.bytes_ for `S` arrays:
+        if isinstance(value, bytes):
+            result.append(bytes(value))
+        elif isinstance(value, basestring):
+            result.append(_cstr(value))
+        else:
+            raise TypeError("Invalid value in string column {!r}: {!r}"
+                            .format(name, value))
+    return result
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef _hash_elements(digest):
+    """Feed names and parameter values of all elements into the hash."""
+    cdef clib.element* elem
+    cdef clib.command_parameter* par
+    cdef int i, j, k
+    cdef Py_ssize_t num = 0
+    for i in range(clib.element_list.curr):
+        num += clib.element_list.elem[i].def_.par.curr
+    # scalar numeric values are collected in an array, all others (strings,
+    # arrays) are hashed by their text representation:
+    values = np.empty(num)
+    others = []
+    cdef double[::1] _values = values
+    num = 0
+    for i in range(clib.element_list.curr):
+        elem = clib.element_list.elem[i]
+        others.append(_str(elem.name))
+        for j in range(elem.def_.par.curr):
+            par = elem.def_.par.parameters[j]
+            _values[num] = _get_param_double(par)
+            num += 1
+            if par.type in (clib.PARAM_TYPE_LOGICAL_ARRAY,
+                            clib.PARAM_TYPE_INTEGER_ARRAY,
+                            clib.PARAM_TYPE_DOUBLE_ARRAY):
+                others.append(_get_param_array(par))
+            elif par.type == clib.PARAM_TYPE_STRING:
+                others.append(_str(par.string))
+            elif par.type == clib.PARAM_TYPE_STRING_ARRAY:
+                if par.m_string is not NULL:
+                    others.append([_str(par.m_string.p[k])
+                                   for k in xrange(par.m_string.curr)])
+            elif par.type == clib.PARAM_TYPE_CONSTRAINT:
+                others.append((par.c_type, par.c_min, par.c_max))
+    digest.update(values)
+    digest.update(_cstr(repr(others)))
+
+
+cdef list _get_param_array(clib.command_parameter* par):
+    """Get the current values of a numeric array parameter."""
+    cdef int k
+    cdef clib.expression* expr
+    values = []
+    if par.double_array is NULL:
+        return values
+    for k in range(par.double_array.curr):
+        expr = NULL
+        if par.expr_list is not NULL and k < par.expr_list.curr:
+            expr = par.expr_list.list[k]
+        if expr is NULL:
+            values.append(par.double_array.a[k])
+        else:
+            values.append(clib.expression_value(expr, 2))
+    return values
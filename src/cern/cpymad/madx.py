@@ -44,11 +44,14 @@ from __future__ import absolute_import
 from functools import partial
 import logging
 import os
+import shutil
 import sys
+import tempfile
 import collections
 
 from . import _libmadx_rpc
-from .types import Element
+from .types import (Constraint, DependencyGraph, Element, ElementList,
+                    Expression)
 
 from cern.cpymad import _madx_tools
 from cern.cpymad.types import TfsTable, TfsSummary
@@ -90,6 +93,85 @@ class ChangeDirectory(object):
             self._os.chdir(self._restore)
 
 
+class Transaction(object):
+
+    """
+    Context manager that restores global variables (and elements) on exit.
+
+    The state is saved in the MAD-X process memory when the context is
+    entered and restored (and discarded) when it is left, regardless of
+    whether an exception occured.
+    """
+
+    def __init__(self, madx, elements=False):
+        """
+        Store parameters for :meth:`Madx.snapshot`.
+
+        :param Madx madx: MAD-X instance
+        :param bool elements: also restore numeric element attributes
+        """
+        self._madx = madx
+        self._elements = elements
+        self._snapshot = None
+
+    def __enter__(self):
+        """Enter 'with' context and take a snapshot."""
+        self._snapshot = self._madx.snapshot(self._elements)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Exit 'with' context and roll back to the snapshot."""
+        try:
+            self._madx.restore(self._snapshot)
+        finally:
+            self._madx.discard_snapshot(self._snapshot)
+
+
+class ScratchDirectory(object):
+
+    """
+    Private temporary working directory for a single MAD-X process.
+
+    MAD-X writes its output files relative to the current working directory
+    of the process. Giving each process its own directory prevents parallel
+    instances from overwriting each other's files. The directory and all of
+    its contents are removed when :meth:`cleanup` is called or the object is
+    garbage collected.
+    """
+
+    # Class level default, so that __del__ works if mkdtemp fails:
+    path = None
+
+    def __init__(self, root=None, prefix='cpymad-'):
+        """
+        Create a new temporary directory.
+
+        :param str root: parent directory, e.g. ``'/dev/shm'`` to keep all
+                         files in memory. ``None`` selects the system default
+                         location for temporary files.
+        :param str prefix: prefix for the directory name
+        """
+        self.path = tempfile.mkdtemp(prefix=prefix, dir=root)
+
+    def __del__(self):
+        """Remove the directory."""
+        self.cleanup()
+
+    def __enter__(self):
+        """Enter 'with' context."""
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Exit 'with' context and remove the directory."""
+        self.cleanup()
+
+    def cleanup(self):
+        """Remove the directory and all files in it."""
+        if self.path:
+            shutil.rmtree(self.path, ignore_errors=True)
+            self.path = None
+
+
 class MadxCommands(object):
 
     """
@@ -124,12 +206,21 @@ class Madx(object):
     '''
     _hfile = None
 
-    def __init__(self, histfile=None, libmadx=None, logger=None):
+    _scratch = None
+
+    def __init__(self, histfile=None, libmadx=None, logger=None,
+                 scratch=None):
         '''
         Initializing Mad-X instance
 
         :param str histfile: (optional) name of file which will contain all Mad-X commands.
         :param object libmadx: :mod:`libmadx` compatible object
+        :param scratch: (optional) run MAD-X in a private temporary
+                        directory that is removed along with this object.
+                        Pass ``True`` to use the default location for
+                        temporary files or the name of a parent directory,
+                        e.g. ``'/dev/shm'`` to keep output files in memory.
+        :type scratch: bool or str
 
         '''
         self._libmadx = libmadx or _libmadx_rpc.LibMadxClient.spawn_subprocess()[0].libmadx
@@ -137,13 +228,25 @@ class Madx(object):
             self._libmadx.start()
         self._log = logger or logging.getLogger(__name__)
 
+        if scratch:
+            root = None if scratch is True else scratch
+            self._scratch = ScratchDirectory(root)
+            self._libmadx.chdir(self._scratch.path)
+
         if histfile:
             self._hfile = open(histfile,'w')
 
     def __del__(self):
-        """Close history file."""
+        """Close history file and remove the scratch directory."""
         if self._hfile:
             self._hfile.close()
+        if self._scratch:
+            self._scratch.cleanup()
+
+    @property
+    def scratch(self):
+        """Get the path of the private working directory (or ``None``)."""
+        return self._scratch and self._scratch.path
 
     @property
     def command(self):
@@ -189,6 +292,33 @@ class Madx(object):
         # of ChangeDirectory:
         return ChangeDirectory(path, self._libmadx)
 
+    def read_file(self, filename):
+        """
+        Read the contents of a file written by MAD-X.
+
+        :param str filename: file name relative to the MAD-X working directory
+        :returns: file contents
+        :rtype: bytes
+        """
+        path = os.path.join(self._libmadx.getcwd(), filename)
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def read_table(self, filename, table=None):
+        """
+        Load a TFS file written by MAD-X into a MAD-X table.
+
+        :param str filename: file name relative to the MAD-X working directory
+        :param str table: table name, defaults to the file name without
+                          extension
+        :returns: proxy object for the loaded table
+        :rtype: Table
+        """
+        if table is None:
+            table = os.path.splitext(os.path.basename(filename))[0]
+        self.command.readtable(file=filename, table=table)
+        return self.get_table(table)
+
     def call(self, filename, chdir=False):
         """
         CALL a file in the MAD-X interpretor.
@@ -367,16 +497,163 @@ class Madx(object):
             self._hfile.write(command)
             self._hfile.flush()
 
-    def get_table(self, table):
+    @property
+    def globals(self):
+        """
+        Get a dict-like accessor for the global variables.
+
+        :rtype: Globals
+        """
+        return Globals(self._libmadx, self._writeHist)
+
+    def assign_errors(self, names, sequence=None, knl=None, ksl=None,
+                      **align):
+        """
+        Assign errors to many elements in a single call.
+
+        :param list names: node names (``qf:1``) or element names
+        :param str sequence: expanded sequence, defaults to the active one
+        :param knl: array ``(len(names), order)`` of normal field errors
+        :param ksl: array ``(len(names), order)`` of skew field errors
+        :param align: arrays (or scalars) of alignment errors, e.g. ``dx``,
+                      ``dy``, ``dpsi`` (see EALIGN for all components)
+        :raises ValueError: if a name or error component is invalid
+
+        This is similar to a SELECT,FLAG=ERROR followed by EALIGN/EFCOMP
+        (with absolute field errors) for each element, but much faster. The
+        passed components replace the previous values. Unlike EALIGN/EFCOMP
+        (without ``add``), components that are not passed keep their
+        previous values instead of being reset to zero. Nothing is changed
+        if an error occurs.
+        """
+        if sequence is None:
+            sequence = self.active_sequence
+        self._libmadx.assign_errors(sequence, list(names), align, knl, ksl)
+
+    def get_errors(self, sequence=None):
+        """
+        Get the assigned errors (like ESAVE) of an expanded sequence.
+
+        :param str sequence: sequence name, defaults to the active one
+        :returns: one row for each node with errors, columns ``name``,
+                  ``k0l``, ``k0sl``, ... and ``dx``, ``dy``, ...
+        :rtype: TfsTable
+        """
+        if sequence is None:
+            sequence = self.active_sequence
+        return TfsTable(self._libmadx.get_errors(sequence, as_unicode=True))
+
+    def track(self, particles, turns, observe=(), **kwargs):
+        """
+        Track particles through the active sequence in a single call.
+
+        :param particles: array ``(N, 6)`` of start coordinates ``x``,
+                          ``px``, ``y``, ``py``, ``t``, ``pt``
+        :param int turns: number of turns
+        :param list observe: names of observation points
+        :param kwargs: further keyword arguments to TRACK (onepass, ...)
+        :returns: array ``(turns+1, 1+len(observe), N, 6)``, see
+                  :func:`cern.cpymad.libmadx.get_track_data`
+        :rtype: numpy.ndarray
+
+        All TRACK/OBSERVE/START/RUN commands are passed to MAD-X in a single
+        input.
+        """
+        particles = list(particles)
+        observe = list(observe)
+        self.input(_madx_tools.mad_track(particles, turns, observe, **kwargs))
+        return self._libmadx.get_track_data(turns, len(particles),
+                                            len(observe) + 1)
+
+    def state_fingerprint(self, scope=None):
+        """
+        Get a hash of the MAD-X state, computed in the MAD-X process.
+
+        :param list scope: parts of the state to be included, any of
+                           ``variables``, ``beam``, ``sequence``,
+                           ``elements``, ``errors`` (default: all)
+        :returns: hexadecimal digest that changes whenever the state changes
+        :rtype: str
+        :raises ValueError: if the scope is invalid
+
+        This is much cheaper than a TWISS and can be used as cache key:
+
+        >>> key = madx.state_fingerprint()
+        >>> if key not in cache:
+        ...     cache[key] = madx.twiss().columns.freeze()
+        """
+        return self._libmadx.get_state_fingerprint(scope)
+
+    def snapshot(self, elements=False):
+        """
+        Save the state of all global variables in the MAD-X process.
+
+        :param bool elements: also save numeric element attributes
+        :returns: snapshot id for :meth:`restore`
+        :rtype: int
+
+        Call :meth:`discard_snapshot` to free the memory when the snapshot
+        is not needed anymore.
+        """
+        return self._libmadx.snapshot(elements)
+
+    def restore(self, snapshot):
+        """
+        Restore the state saved by :meth:`snapshot`.
+
+        :param int snapshot: snapshot id
+        :raises KeyError: if the snapshot does not exist
+        """
+        self._libmadx.restore(snapshot)
+
+    def discard_snapshot(self, snapshot):
+        """
+        Free the memory of a snapshot.
+
+        :param int snapshot: snapshot id
+        :raises KeyError: if the snapshot does not exist
+        """
+        self._libmadx.discard_snapshot(snapshot)
+
+    def transaction(self, elements=False):
+        """
+        Return a context manager that rolls back all variable changes.
+
+        :param bool elements: also roll back numeric element attributes
+        :rtype: Transaction
+
+        >>> with madx.transaction():
+        ...     madx.globals['kqf'] = 0.1
+        ...     madx.twiss(sequence='lhcb1')
+        """
+        return Transaction(self, elements)
+
+    def create_table(self, table, columns):
+        """
+        Create a MAD-X table from column arrays without any file I/O.
+
+        :param str table: table name, an existing table is replaced
+        :param dict columns: mapping ``{column: values}``
+        :returns: a proxy object for the new table
+        :rtype: Table
+        :raises ValueError: if the columns have different lengths
+        :raises TypeError: if a value can not be converted to the column type
+
+        MAD-X table names are case insensitive and stored in lowercase.
+        """
+        self._libmadx.create_table(table, columns)
+        return Table(table.lower(), self._libmadx, _check=False)
+
+    def get_table(self, table, rows=None):
         """
         Get the specified table columns as numpy arrays.
 
         :param str table: table name
-        :param columns: column names
-        :type columns: list or str (comma separated)
+        :param rows: row selection evaluated in the MAD-X process, see
+                     :func:`cern.cpymad.libmadx.get_table_column`
 
         """
-        return Table(table, self._libmadx)
+        return Table(table, self._libmadx, rows=rows)
 
     @property
     def active_sequence(self):
@@ -401,7 +678,8 @@ class Madx(object):
         :rtype: Sequence
         :raises RuntimeError: if there is no active sequence
         """
-        return Sequence(self.active_sequence, self._libmadx, _check=False)
+        return Sequence(self.active_sequence, self._libmadx, _check=False,
+                        _input=self.input)
 
     def get_sequence(self, name):
         """
@@ -412,7 +690,32 @@ class Madx(object):
         :rtype: Sequence
         :raises ValueError: if a sequence name is invalid
         """
-        return Sequence(name, self._libmadx)
+        return Sequence(name, self._libmadx, _input=self.input)
+
+    def build_sequence(self, name, length, elements, refer='centre'):
+        """
+        Define a sequence from columnar element data in a single call.
+
+        :param str name: sequence name
+        :param float length: sequence length
+        :param dict elements: arrays ``name``, ``class``, ``at`` and further
+                              numeric attributes (NaN if not set)
+        :param str refer: ``entry``, ``centre`` or ``exit``
+        :returns: a proxy object for the new sequence
+        :rtype: Sequence
+
+        Example:
+
+        >>> madx.build_sequence('ring', 10, {
+        ...     'name': ['qf', 'qd'],
+        ...     'class': ['quadrupole', 'quadrupole'],
+        ...     'at': [2.5, 7.5],
+        ...     'l': [1, 1],
+        ...     'k1': [0.1, -0.1]})
+        """
+        self.input(_madx_tools.mad_sequence(name, length, elements, refer))
+        return Sequence(name, self._libmadx, _check=False,
+                        _input=self.input)
 
     def get_sequences(self):
         """
@@ -421,7 +724,8 @@ class Madx(object):
         :returns: list of sequence proxy objects
         :rtype: list(Sequence)
         """
-        return [Sequence(name, self._libmadx, _check=False)
+        return [Sequence(name, self._libmadx, _check=False,
+                         _input=self.input)
                 for name in self.get_sequence_names()]
 
     def get_sequence_names(self):
@@ -444,6 +748,144 @@ class Madx(object):
         """
         return self._libmadx.evaluate(cmd)
 
+    def dump_globals(self):
+        """
+        Get all global variables in a single call.
+
+        :returns: columns ``name``, ``value``, ``expr`` and ``kind`` (one of
+                  ``constant``, ``direct``, ``deferred``, ``string``)
+        :rtype: TfsTable
+        """
+        return TfsTable(self._libmadx.get_globals(as_unicode=True))
+
+    def get_dependency_graph(self):
+        """
+        Get the dependencies between variables and element attributes.
+
+        :returns: graph of deferred expressions, use
+                  :meth:`DependencyGraph.dependents` to find out which
+                  variables and element attributes are affected by a change
+        :rtype: DependencyGraph
+        """
+        graph = self._libmadx.get_dependency_graph()
+        return DependencyGraph(graph['name'], graph['indptr'],
+                               graph['indices'])
+
+    def evaluate_many(self, exprs):
+        """
+        Evaluate many expressions in a single call.
+
+        :param list exprs: expressions to evaluate
+        :returns: tuple ``(values, errors)``, where ``values`` is a float64
+                  array and ``errors`` a boolean array that is true for
+                  invalid expressions (whose values are NaN)
+        :rtype: tuple
+        """
+        return self._libmadx.evaluate_many(list(exprs))
+
+    def update_expressions(self, elements):
+        """
+        Evaluate all expressions in the given elements in a single call.
+
+        :param list elements: elements as returned by
+                              :meth:`Sequence.get_elements`
+        :returns: the elements, whose :class:`Expression` values are updated
+                  in-place
+        """
+        exprs = [expr
+                 for elem in elements
+                 for key in elem
+                 for expr in _iter_expressions(elem[key])]
+        values, errors = self.evaluate_many([expr.expr for expr in exprs])
+        for expr, value in zip(exprs, values):
+            expr._value = value
+        return elements
+
+
+class Globals(object):
+
+    """
+    Dict-like accessor for MAD-X global variables.
+
+    Values are read and written directly through the MAD-X C API, bypassing
+    the command parser. Multiple variables can be accessed at once:
+
+    >>> madx.globals['kqf']
+    >>> madx.globals[['kqf', 'kqd']] = numpy.array([0.1, -0.1])
+    >>> madx.globals.update({'kqf': 0.1, 'kqd': -0.1})
+    """
+
+    def __init__(self, libmadx, write_hist=None):
+        """
+        Store libmadx connection.
+
+        :param libmadx: :mod:`libmadx` compatible object
+        :param write_hist: callable that records equivalent MAD-X input
+        """
+        self._libmadx = libmadx
+        self._write_hist = write_hist
+
+    def __getitem__(self, name):
+        """
+        Get the value of one or more variables.
+
+        :param name: variable name or list of names
+        :returns: value or array of values
+        :raises KeyError: if a variable is not defined
+        """
+        if isinstance(name, basestring):
+            return self._libmadx.get_variables([name])[0]
+        return self._libmadx.get_variables(list(name))
+
+    def __setitem__(self, name, value):
+        """
+        Set the value of one or more variables.
+
+        :param name: variable name or list of names
+        :param value: value or array of values
+        """
+        if isinstance(name, basestring):
+            names, values = [name], [value]
+        else:
+            names = list(name)
+            if hasattr(value, '__len__'):
+                values = list(value)
+            else:
+                values = [value] * len(names)
+        self._record(names, values)
+        self._libmadx.set_variables(names, values)
+
+    def update(self, mapping):
+        """
+        Set many variables in a single call.
+
+        :param dict mapping: new values ``{name: value}``
+        """
+        mapping = dict(mapping)
+        self._record(list(mapping), list(mapping.values()))
+        self._libmadx.set_variables(mapping)
+
+    def _record(self, names, values):
+        """Write the equivalent assignments to the history."""
+        if self._write_hist is not None:
+            self._write_hist(''.join(
+                '{} = {!r};\n'.format(name, float(value))
+                for name, value in zip(names, values)))
+
+
+def _iter_expressions(value):
+    """Iterate over all :class:`Expression` objects in a parameter value."""
+    if isinstance(value, Expression):
+        yield value
+    elif isinstance(value, Constraint):
+        for part in (value.val, value.min, value.max):
+            if isinstance(part, Expression):
+                yield part
+    elif isinstance(value, list):
+        for item in value:
+            if isinstance(item, Expression):
+                yield item
+
 
 class Sequence(object):
 
@@ -451,10 +893,18 @@ class Sequence(object):
     MAD-X sequence representation.
     """
 
-    def __init__(self, name, libmadx, _check=True):
-        """Store sequence name."""
+    def __init__(self, name, libmadx, _check=True, _input=None):
+        """
+        Store sequence name.
+
+        :param str name: sequence name
+        :param libmadx: :mod:`libmadx` compatible object
+        :param _input: callable that executes (and records) MAD-X input,
+                       defaults to ``libmadx.input``
+        """
         self._name = name
         self._libmadx = libmadx
+        self._input = _input or libmadx.input
         if _check and not libmadx.sequence_exists(name):
             raise ValueError("Invalid sequence: {!r}".format(name))
 
@@ -469,6 +919,17 @@ class Sequence(object):
         """Get the name of the sequence."""
         return self._name
 
+    @property
+    def version(self):
+        """
+        Get a counter that increases whenever the sequence may have changed.
+
+        Like :attr:`Table.version`, the counter is conservative. It also
+        increases on variable assignments, since these may change element
+        attributes through deferred expressions.
+        """
+        return self._libmadx.get_sequence_version(self._name)
+
     @property
     def beam(self):
         """Get the beam dictionary associated to the sequence."""
@@ -484,28 +945,199 @@ class Sequence(object):
         """Get the name of the table with the TWISS results."""
         return self._libmadx.get_twiss(self._name)
 
-    def get_elements(self):
+    def get_elements(self, lazy=False, sparse=False, normalized=False):
         """
         Get list of all elements in the original sequence.
 
+        :param bool lazy: don't evaluate expressions, see below
+        :param bool sparse: omit parameters with default values
+        :param bool normalized: transfer shared element definitions only
+                                once and return an :class:`ElementList`
         :returns: list of elements in the original (unexpanded) sequence
         :rtype: list(Element)
+
+        With ``lazy=True``, expression values are the ones last computed by
+        MAD-X, which is much faster for expression-heavy lattices. Use
+        :meth:`Madx.update_expressions` to evaluate them in a single call.
+
+        With ``sparse=True``, only explicitly set parameters are returned,
+        which considerably reduces the size of the result.
+
+        With ``normalized=True``, each element definition is extracted only
+        once, no matter how many nodes share it. This reduces extraction
+        time and memory by the node-to-definition ratio.
         """
+        if normalized:
+            return ElementList(*self._libmadx.get_normalized_elements(
+                self._name, False, lazy, sparse))
         return [Element(elem)
-                for elem in self._libmadx.get_elements(self._name)]
+                for elem in self._libmadx.get_elements(self._name,
+                                                       lazy, sparse)]
 
-    def get_expanded_elements(self):
+    def get_expanded_elements(self, lazy=False, sparse=False,
+                              normalized=False):
         """
         Get list of all elements in the expanded sequence.
 
+        :param bool lazy: don't evaluate expressions, see :meth:`get_elements`
+        :param bool sparse: omit parameters with default values
+        :param bool normalized: return an :class:`ElementList`, see
+                                :meth:`get_elements`
         :returns: list of elements in the expanded (unexpanded) sequence
         :rtype: list(Element)
 
         NOTE: this may very well return an empty list, if the sequence has
         not been expanded (used) yet.
         """
+        if normalized:
+            return ElementList(*self._libmadx.get_normalized_elements(
+                self._name, True, lazy, sparse))
         return [Element(elem)
-                for elem in self._libmadx.get_expanded_elements(self._name)]
+                for elem in self._libmadx.get_expanded_elements(self._name,
+                                                                lazy, sparse)]
+
+    def set_element_attributes(self, names, attribute, values):
+        """
+        Set a numeric attribute for many elements at once.
+
+        :param list names: names of elements used in this sequence
+        :param str attribute: attribute name, e.g. ``k1``
+        :param values: array of values or a single value for all elements
+        :raises ValueError: if an element or attribute is invalid or an
+                            element is not used in this sequence
+
+        Note that element definitions are global in MAD-X, i.e. the changes
+        affect all sequences that use these elements.
+        """
+        self._libmadx.set_element_attributes(
+            list(names), attribute, values, self._name)
+
+    def edit(self, flatten=True):
+        """
+        Get a batch editor that applies all operations at once.
+
+        :param bool flatten: flatten the sequence after editing
+        :rtype: SequenceEditor
+
+        The operations are applied in a single SEQEDIT block when the
+        ``with`` context is left without exception:
+
+        >>> with sequence.edit() as ed:
+        ...     ed.install(['bpm1', 'bpm2'], 'monitor', at=[1.0, 2.0])
+        ...     ed.remove(['mcb1'])
+        """
+        return SequenceEditor(self._name, self._input, flatten)
+
+    def get_element_table(self, attributes=(), expanded=False):
+        """
+        Get columnar data for all elements in the sequence.
+
+        :param list attributes: additional numeric attributes, e.g. ``k1``
+        :param bool expanded: use the expanded instead of original sequence
+        :returns: arrays for ``name``, ``type``, ``at``, ``l`` and the
+                  requested attributes (NaN where undefined)
+        :rtype: TfsTable
+
+        This is much faster than :meth:`get_elements` for large sequences.
+        """
+        return TfsTable(self._libmadx.get_element_table(
+            self._name, attributes, expanded, as_unicode=True))
+
+
+class SequenceEditor(object):
+
+    """
+    Collects SEQEDIT operations and applies them in a single call.
+
+    Each method accepts lists of element names and lists (or scalars) of the
+    corresponding parameter values.
+    """
+
+    def __init__(self, name, input, flatten=True):
+        """
+        Store sequence name, input function and flatten option.
+
+        :param str name: sequence name
+        :param input: callable that executes MAD-X input, e.g.
+                      :meth:`Madx.input`
+        :param bool flatten: flatten the sequence after editing
+        """
+        self._name = name
+        self._input = input
+        self._flatten = flatten
+        self._operations = []
+
+    def __enter__(self):
+        """Enter 'with' context."""
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Exit 'with' context and apply operations if there was no error."""
+        if exc_type is None:
+            self.apply()
+
+    def install(self, names, classes, at, from_=None):
+        """
+        Install new elements.
+
+        :param list names: names of the new elements
+        :param classes: element classes (or names of element definitions)
+        :param at: positions
+        :param from_: reference elements for the positions
+        """
+        self._add('install', names, {'class': classes, 'at': at,
+                                     'from': from_})
+
+    def move(self, names, by=None, to=None, from_=None):
+        """
+        Move elements.
+
+        :param list names: element names
+        :param by: relative displacements
+        :param to: new positions
+        :param from_: reference elements for ``to``
+        """
+        self._add('move', names, {'by': by, 'to': to, 'from': from_})
+
+    def remove(self, names):
+        """
+        Remove elements.
+
+        :param list names: element names or patterns
+        """
+        self._add('remove', names, {})
+
+    def replace(self, names, by):
+        """
+        Replace elements.
+
+        :param list names: names of the elements to be replaced
+        :param by: names of the replacement elements
+        """
+        self._add('replace', names, {'by': by})
+
+    def apply(self):
+        """Apply all collected operations and clear the list."""
+        operations, self._operations = self._operations, []
+        if operations:
+            self._input(_madx_tools.mad_seqedit(self._name, operations,
+                                                self._flatten))
+
+    def _add(self, command, names, params):
+        """Add an operation with broadcasted parameter columns."""
+        names = list(names)
+        columns = {'element': names}
+        for key, values in params.items():
+            if values is None:
+                continue
+            if isinstance(values, basestring) or \
+                    not hasattr(values, '__len__'):
+                values = [values] * len(names)
+            elif len(values) != len(names):
+                raise ValueError("Invalid number of {!r} values: {}"
+                                 .format(key, len(values)))
+            columns[key] = list(values)
+        self._operations.append((command, columns))
 
 
 class Table(object):
@@ -514,31 +1146,85 @@ class Table(object):
     MAD-X table access class.
     """
 
-    def __init__(self, name, libmadx, _check=True):
-        """Just store the table name for now."""
+    def __init__(self, name, libmadx, _check=True, rows=None):
+        """
+        Just store the table name and row selection for now.
+
+        :param str name: table name
+        :param libmadx: :mod:`libmadx` compatible object
+        :param rows: row selection evaluated in the MAD-X process, see
+                     :func:`cern.cpymad.libmadx.get_table_column`
+        """
         self._name = name
         self._libmadx = libmadx
+        self._rows = rows
         if _check and not libmadx.table_exists(name):
             raise ValueError("Invalid table: {!r}".format(name))
 
     def __iter__(self):
         """Old style access."""
-        columns = self.columns
-        try:
-            summary = self.summary
-        except ValueError:
-            summary = None
-        return iter((columns, summary))
+        data, summary = self._libmadx.get_table(self._name, rows=self._rows)
+        if summary is not None:
+            summary = TfsSummary(summary)
+        return iter((TfsTable(data), summary))
 
     @property
     def name(self):
         """Get the table name."""
         return self._name
 
+    @property
+    def version(self):
+        """
+        Get a counter that increases whenever the table may have changed.
+
+        This can be used to check whether cached table data is outdated.
+        The counter is conservative: it increases for every input that may
+        recreate or modify tables, i.e. every command except for variable
+        assignments and a few read-only commands (``option``, ``show``,
+        ``value``, ...), even if this table was left unchanged.
+        """
+        return self._libmadx.get_table_version(self._name)
+
     @property
     def columns(self):
         """Get a lazy accessor for the table columns."""
-        return TableColumns(self.name, self._libmadx)
+        return TableColumns(self.name, self._libmadx, self._rows)
+
+    def select(self, rows):
+        """
+        Get a view of the table that transfers only the selected rows.
+
+        :param rows: row selection, see
+                     :func:`cern.cpymad.libmadx.get_table_column`
+        :returns: table proxy with the row selection
+        :rtype: Table
+
+        Example:
+
+        >>> twiss.select(types.RowFilter(name='bpm', s=(0, 1000))).columns.betx
+        """
+        return Table(self._name, self._libmadx, _check=False, rows=rows)
+
+    def rmatrices(self, rows=None):
+        """
+        Get the transfer matrices of all (or the selected) rows.
+
+        :param rows: row selection, see
+                     :func:`cern.cpymad.libmadx.get_table_column`, defaults
+                     to the row selection of this table view
+        :returns: array ``(rows, 6, 6)`` of the ``re11`` .. ``re66`` columns
+        :rtype: numpy.ndarray
+        :raises ValueError: if the table has no transfer matrix columns or
+                            both this view and ``rows`` select rows
+
+        This requires TWISS to be invoked with ``rmatrix=True``.
+        """
+        if rows is None:
+            rows = self._rows
+        elif self._rows is not None:
+            raise ValueError("Cannot combine row selections.")
+        return self._libmadx.get_rmatrices(self._name, rows)
 
     @property
     def summary(self):
@@ -552,10 +1238,11 @@ class TableColumns(object):
     Lazy accessor for table column data.
     """
 
-    def __init__(self, table, libmadx):
-        """Store tabe name and libmadx connection."""
+    def __init__(self, table, libmadx, rows=None):
+        """Store tabe name, row selection and libmadx connection."""
         self._table = table
         self._libmadx = libmadx
+        self._rows = rows
 
     def __getattr__(self, column):
         """Get the column data."""
@@ -567,7 +1254,8 @@ class TableColumns(object):
             try:
                 return self._libmadx.get_table_column(
                     self._table,
-                    column.lower())
+                    column.lower(),
+                    self._rows)
             except ValueError:
                 raise KeyError(column)
         elif isinstance(column, collections.Sequence):
@@ -580,15 +1268,23 @@ class TableColumns(object):
         """Get a list of all column names."""
         return iter(self._libmadx.get_table_columns(self._table))
 
-    def freeze(self, columns=None):
+    def freeze(self, columns=None, categorical=False, as_unicode=False):
         """
         Return a frozen table with the desired columns.
 
         :param list columns: column names or ``None`` for all columns.
+        :param bool categorical: transfer string columns dictionary encoded
+                                 and return them as :class:`Categorical`
+        :param bool as_unicode: return string columns (or categories) as
+                                unicode (``U``) instead of bytes (``S``)
         :returns: column data
         :rtype: TfsTable
         :raises ValueError: if the table name is invalid
         """
-        if columns is None:
-            columns = self
-        return TfsTable(dict((column, self[column]) for column in columns))
+        if columns is not None:
+            columns = [column.lower() for column in columns]
+        data, summary = self._libmadx.get_table(self._table, columns,
+                                                self._rows,
+                                                as_unicode=as_unicode,
+                                                categorical=categorical)
+        return TfsTable(data)
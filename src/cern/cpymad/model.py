@@ -270,9 +270,8 @@ class Model(object):
 
     def set_knob(self,knob,value):
         kdict = self._mdef['knobs']
-        for e in kdict[knob]:
-            val = kdict[knob][e] * value
-            self._madx.command(**{e: val})
+        self._madx.globals.update(dict(
+            (e, kdict[knob][e] * value) for e in kdict[knob]))
 
     def get_sequences(self):
         '''
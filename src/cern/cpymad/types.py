@@ -4,13 +4,23 @@ Python type analogues for MAD-X data structures.
 
 from collections import namedtuple
 
+try:
+    basestring
+except NameError:   # python3
+    basestring = str
+
 __all__ = ['LookupDict',
            'TfsTable',
            'TfsSummary',
            'Range',
+           'RowFilter',
+           'Categorical',
            'Constraint',
            'Expression',
-           'Element']
+           'DependencyGraph',
+           'Element',
+           'ElementView',
+           'ElementList']
 
 
 class LookupDict(object):
@@ -98,6 +108,16 @@ class TfsTable(LookupDict):
         except KeyError:
             pass
 
+    def __getitem__(self, key):
+        """
+        Return column data associated to the given key.
+
+        :param key: case-insensitive column name or a sequence of names
+        """
+        if isinstance(key, basestring):
+            return LookupDict.__getitem__(self, key)
+        return key.__class__(self[column] for column in key)
+
 
 class TfsSummary(LookupDict):
 
@@ -109,6 +129,96 @@ class TfsSummary(LookupDict):
 Range = namedtuple('Range', ['first', 'last'])
 
 
+class RowFilter(object):
+
+    """
+    Row selection criteria for table data, evaluated by the MAD-X process.
+
+    All given criteria must be met for a row to be selected.
+    """
+
+    def __init__(self, name=None, keyword=None, s=None):
+        """
+        Store the selection criteria.
+
+        :param str name: regular expression to be matched case-insensitively
+                         against the beginning of the element name
+        :param keyword: element class name or list of class names
+        :type keyword: str or list
+        :param tuple s: ``(min, max)`` range of the ``s`` column, either
+                        bound may be ``None``
+        """
+        self.name = name
+        self.keyword = keyword
+        self.s = s
+
+
+class Categorical(object):
+
+    """
+    Dictionary encoded array of (repetitive) string values.
+
+    :ivar categories: array of distinct values
+    :ivar codes: int32 array of indices into ``categories``
+
+    Comparison with a single value returns a boolean mask without expanding
+    the data. Use :meth:`expand` (or ``numpy.asarray``) to get the plain
+    string array.
+    """
+
+    def __init__(self, categories, codes):
+        """
+        Store categories and codes.
+
+        :param categories: numpy array of distinct values
+        :param codes: numpy array of indices into ``categories``
+        """
+        self.categories = categories
+        self.codes = codes
+
+    def __repr__(self):
+        """Show categories and number of values."""
+        return '{0}({1!r}, len={2})'.format(
+            self.__class__.__name__, list(self.categories), len(self))
+
+    def __len__(self):
+        """Get the number of values."""
+        return len(self.codes)
+
+    def __getitem__(self, index):
+        """Get a single value or a :class:`Categorical` subset."""
+        codes = self.codes[index]
+        if getattr(codes, 'ndim', 0) == 0:
+            return self.categories[codes]
+        return Categorical(self.categories, codes)
+
+    def __iter__(self):
+        """Iterate over the values."""
+        categories = self.categories
+        for code in self.codes:
+            yield categories[code]
+
+    def __eq__(self, value):
+        """Get a boolean mask of the entries equal to ``value``."""
+        return (self.categories == value)[self.codes]
+
+    def __ne__(self, value):
+        """Get a boolean mask of the entries not equal to ``value``."""
+        return (self.categories != value)[self.codes]
+
+    __hash__ = None
+
+    def __array__(self, dtype=None, copy=None):
+        """Get the expanded array (numpy array interface)."""
+        # expanding always creates a new array, so ``copy`` can be ignored:
+        data = self.expand()
+        return data if dtype is None else data.astype(dtype, copy=False)
+
+    def expand(self):
+        """Get the plain array of values."""
+        return self.categories[self.codes]
+
+
 class Constraint(object):
 
     """Represents a MAD-X constraint, which has either min/max/both/value."""
@@ -164,6 +274,51 @@ class Expression(object):
         return float(self._value)
 
 
+class DependencyGraph(object):
+
+    """
+    Dependencies between global variables and element attributes.
+
+    :ivar name: node names (variables and ``element->attribute``)
+    :ivar indptr: start offsets of the dependents of each node
+    :ivar indices: node indices of the dependents
+    """
+
+    def __init__(self, name, indptr, indices):
+        """Store graph in compressed sparse row format."""
+        self.name = name
+        self.indptr = indptr
+        self.indices = indices
+        self._index = dict((n, i) for i, n in enumerate(name))
+
+    def dependents(self, names, recursive=True):
+        """
+        Get the names of all nodes that depend on the given nodes.
+
+        :param list names: names of changed variables/attributes
+        :param bool recursive: include indirect dependents
+        :returns: names of the affected nodes (excluding the given ones)
+        :rtype: set
+        """
+        if isinstance(names, basestring):
+            names = [names]
+        start = [self._index[name.lower()] for name in names
+                 if name.lower() in self._index]
+        seen = set(start)
+        result = set()
+        stack = list(start)
+        while stack:
+            node = stack.pop()
+            for dep in self.indices[self.indptr[node]:self.indptr[node+1]]:
+                if dep in seen:
+                    continue
+                seen.add(dep)
+                result.add(self.name[dep])
+                if recursive:
+                    stack.append(dep)
+        return result
+
+
 class Element(LookupDict):
 
     """
@@ -171,3 +326,97 @@ class Element(LookupDict):
     """
 
     pass
+
+
+class ElementView(Element):
+
+    """
+    Element of a sequence node that shares its element definition.
+
+    The node specific attributes are combined with the attributes of the
+    definition only when the element is accessed for the first time.
+    """
+
+    # Class level defaults, so that attribute lookups on partially
+    # initialized instances (e.g. during unpickling) do not recurse into
+    # __getattr__:
+    _definition = None
+    _node = None
+    _resolved = None
+
+    def __init__(self, definition, node):
+        """
+        Store references to the element definition and node attributes.
+
+        :param Element definition: shared element definition
+        :param dict node: node specific attributes
+        """
+        # Don't call LookupDict.__init__, its assignments to _data would
+        # resolve the combined attributes right away:
+        self._definition = definition
+        self._node = dict((self._unify_key(key), val)
+                          for key, val in node.items())
+
+    @property
+    def _data(self):
+        """Get the combined attributes of definition and node."""
+        if self._resolved is None:
+            data = {}
+            if self._definition is not None:
+                data.update(self._definition._data)
+            if self._node is not None:
+                data.update(self._node)
+            self._resolved = data
+        return self._resolved
+
+    @_data.setter
+    def _data(self, data):
+        """Set the node specific attributes."""
+        self._node = data
+        self._resolved = None
+
+
+class ElementList(object):
+
+    """
+    List of sequence elements in normalized representation.
+
+    Element definitions that are shared by multiple nodes are stored only
+    once in :attr:`definitions`. The node data is stored in columnar form in
+    :attr:`nodes` (``name``, ``definition`` index, ``at``, ``l``). Indexing
+    and iteration yield :class:`ElementView` objects.
+    """
+
+    def __init__(self, definitions, nodes):
+        """
+        Store element definitions and node data.
+
+        :param list definitions: element definitions (dicts)
+        :param dict nodes: mapping of node data arrays
+        """
+        self.definitions = [Element(data) for data in definitions]
+        self.nodes = nodes
+
+    def __len__(self):
+        """Get the number of nodes."""
+        return len(self.nodes['name'])
+
+    def __getitem__(self, index):
+        """Get a view of the element at the given node index or a list of
+        views for a slice."""
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        nodes = self.nodes
+        definition = self.definitions[nodes['definition'][index]]
+        return ElementView(definition, {'name': nodes['name'][index],
+                                        'at': float(nodes['at'][index]),
+                                        'l': float(nodes['l'][index])})
+
+    def __iter__(self):
+        """Iterate over views of all elements."""
+        for index in range(len(self)):
+            yield self[index]
@@ -13,3 +13,6 @@ class TestCase(object):
         """Method missing in python2.6."""
         self.assertTrue(first < second)
 
+    def assertGreater(self, first, second):
+        """Method missing in python2.6."""
+        self.assertTrue(first > second)
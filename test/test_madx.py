@@ -1,9 +1,13 @@
 # standard library
+import os
+import pickle
+import tempfile
 import unittest
 import _compat
 
 # tested class
-from cern.cpymad.madx import Madx
+from cern.cpymad.madx import Madx, ScratchDirectory
+from cern.cpymad.types import RowFilter
 
 class TestMadx(unittest.TestCase, _compat.TestCase):
 
@@ -64,6 +68,164 @@ class TestMadx(unittest.TestCase, _compat.TestCase):
         self._check_twiss('s2')     # s2 can be computed at start
         self._check_twiss('s1')     # s1 can be computed after s2
 
+    def test_string_column(self):
+        self.mad.command('beam, ex=1, ey=2, particle=electron, sequence=s1;')
+        self.mad.twiss(sequence='s1', betx=2.5, bety=3.5)
+        libmadx = self.mad._libmadx
+        names = libmadx.get_table_column('twiss', 'name')
+        self.assertEqual(names.dtype.kind, 'S')
+        self.assertEqual(names[1].lower(), b'qp:1')
+        upper = libmadx.get_table_column('twiss', 'name', as_unicode=True)
+        lower = libmadx.get_table_column('twiss', 'name', lower=True,
+                                         as_unicode=True)
+        self.assertEqual(upper.dtype.kind, 'U')
+        self.assertEqual(list(lower), [n.lower() for n in upper])
+
+    def test_categorical_column(self):
+        self.mad.command('beam, ex=1, ey=2, particle=electron, sequence=s1;')
+        self.mad.twiss(sequence='s1', betx=2.5, bety=3.5)
+        libmadx = self.mad._libmadx
+        plain = libmadx.get_table_column('twiss', 'keyword', as_unicode=True)
+        keyword = libmadx.get_table_column('twiss', 'keyword',
+                                           as_unicode=True, categorical=True)
+        self.assertEqual(len(keyword), len(plain))
+        self.assertEqual(len(keyword.categories), len(set(plain)))
+        self.assertEqual(list(keyword.expand()), list(plain))
+        self.assertEqual(list(keyword == 'quadrupole'),
+                         list(plain == 'quadrupole'))
+        frozen = self.mad.get_table('twiss').columns.freeze(
+            ['name', 'betx'], categorical=True)
+        self.assertEqual(len(frozen['name']), len(frozen['betx']))
+        columns = self.mad.get_table('twiss').columns
+        frozen = columns.freeze(['keyword'], categorical=True,
+                                as_unicode=True)
+        self.assertEqual(list(frozen['keyword'] == 'quadrupole'),
+                         list(plain == 'quadrupole'))
+        self.assertTrue(any(frozen['keyword'] == 'quadrupole'))
+        # the string type does not depend on the encoding:
+        frozen = columns.freeze(['keyword'], categorical=True)
+        self.assertEqual(list(frozen['keyword'] == b'quadrupole'),
+                         list(columns.freeze(['keyword'])['keyword'] ==
+                              b'quadrupole'))
+
+    def test_table_rmatrices(self):
+        self.mad.command('beam, ex=1, ey=2, particle=electron, sequence=s1;')
+        twiss = self.mad.twiss(sequence='s1', betx=2.5, bety=3.5,
+                               rmatrix=True)
+        rmat = twiss.rmatrices()
+        num = len(twiss.columns['s'])
+        self.assertEqual(rmat.shape, (num, 6, 6))
+        self.assertAlmostEqual(rmat[-1, 0, 1], twiss.columns['re12'][-1])
+        self.assertAlmostEqual(rmat[-1, 3, 2], twiss.columns['re43'][-1])
+        self.assertEqual(twiss.rmatrices([0, 2]).shape, (2, 6, 6))
+
+    def test_create_table(self):
+        table = self.mad.create_table('mytab', {
+            'name': ['a', 'bc', 'def'],
+            'x': [1.0, 2.5, -3.0],
+        })
+        self.assertTrue(self.mad._libmadx.table_exists('mytab'))
+        data = table.columns.freeze()
+        self.assertEqual(list(data['x']), [1.0, 2.5, -3.0])
+        self.assertEqual(list(data['name']), [b'a', b'bc', b'def'])
+        self.assertRaises(ValueError, self.mad.create_table, 'bad',
+                          {'x': [1], 'y': [1, 2]})
+        self.assertRaises(TypeError, self.mad.create_table, 'bad',
+                          {'name': ['a', None, 3]})
+        self.assertFalse(self.mad._libmadx.table_exists('bad'))
+        table = self.mad.create_table('MyTab', {'x': [1.0]})
+        self.assertEqual(list(table.columns.freeze()['x']), [1.0])
+
+    def test_create_table_bytes(self):
+        self.mad.command('beam, ex=1, ey=2, particle=electron, sequence=s1;')
+        self.mad.twiss(sequence='s1', betx=2.5, bety=3.5)
+        names = self.mad._libmadx.get_table_column('twiss', 'name')
+        self.assertEqual(names.dtype.kind, 'S')
+        table = self.mad.create_table('copy', {'name': names})
+        self.assertEqual(list(table.columns.freeze()['name']), list(names))
+
+    def test_table_freeze(self):
+        self.mad.command('beam, ex=1, ey=2, particle=electron, sequence=s1;')
+        table = self.mad.twiss(sequence='s1', betx=2.5, bety=3.5)
+        frozen = table.columns.freeze(['BETX', 'bety'])
+        self.assertItemsEqual(frozen.keys(), ['betx', 'bety'])
+        betx, bety = frozen['betx', 'bety']
+        self.assertAlmostEqual(betx[0], 2.5)
+        self.assertAlmostEqual(bety[0], 3.5)
+        data, summary = self.mad._libmadx.get_table('twiss')
+        self.assertItemsEqual(data.keys(), table.columns)
+        self.assertAlmostEqual(summary['ex'], 1)
+
+    def test_table_rows(self):
+        self.mad.command('beam, ex=1, ey=2, particle=electron, sequence=s1;')
+        table = self.mad.twiss(sequence='s1', betx=2.5, bety=3.5)
+        betx = table.columns.betx
+        self.assertEqual(list(table.select(slice(1, 3)).columns.betx),
+                         list(betx[1:3]))
+        self.assertEqual(list(table.select([0, -1]).columns.betx),
+                         [betx[0], betx[-1]])
+        quads = table.select(RowFilter(keyword='quadrupole')).columns
+        self.assertEqual(len(quads.betx), 2)
+        qp = table.select(RowFilter(name='qp', s=(0, 1.5)))
+        self.assertEqual([n.lower() for n in qp.columns.name], [b'qp:1'])
+
+    def test_table_version(self):
+        self.mad.command('beam, ex=1, ey=2, particle=electron, sequence=s1;')
+        table = self.mad.twiss(sequence='s1', betx=2.5, bety=3.5)
+        version = table.version
+        self.assertEqual(table.version, version)
+        self.mad.command('option, -echo;')
+        self.assertEqual(table.version, version)
+        self.mad.twiss(sequence='s1', betx=2.5, bety=3.5)
+        self.assertGreater(table.version, version)
+        version = table.version
+        self.mad.input('x_unused = 1;')
+        self.assertEqual(table.version, version)
+        # comments are line-based and don't hide the following command:
+        self.mad.input('! compute optics\n'
+                       'twiss, sequence=s1, betx=2.5, bety=3.5;')
+        self.assertGreater(table.version, version)
+
+    def test_sequence_version(self):
+        seq = self.mad.get_sequence('s1')
+        version = seq.version
+        self.mad.command('option, -echo;')
+        self.assertEqual(seq.version, version)
+        # node count and addresses are unchanged within a single input:
+        self.mad.input('seqedit, sequence=s1;'
+                       'install, element=m1, class=marker, at=0.1;'
+                       'remove, element=m1;'
+                       'flatten; endedit;')
+        self.assertGreater(seq.version, version)
+        version = seq.version
+        with seq.edit() as ed:
+            ed.move(['sb'], by=0.1)
+        self.assertGreater(seq.version, version)
+        version = seq.version
+        seq.set_element_attributes(['qp'], 'k1', 1)
+        self.assertGreater(seq.version, version)
+
+    def test_scratch(self):
+        mad = Madx(scratch=True)
+        scratch = mad.scratch
+        self.assertTrue(os.path.isdir(scratch))
+        for line in self.doc.splitlines():
+            mad._libmadx.input(line)
+        mad.command('beam, ex=1, ey=2, particle=electron, sequence=s1;')
+        mad.twiss(sequence='s1', fname='s1.tfs', betx=2.5, bety=3.5)
+        self.assertTrue(os.path.isfile(os.path.join(scratch, 's1.tfs')))
+        self.assertTrue(mad.read_file('s1.tfs').startswith(b'@'))
+        columns, summary = mad.read_table('s1.tfs')
+        self.assertAlmostEqual(columns.betx[0], 2.5)
+        del mad
+        self.assertFalse(os.path.exists(scratch))
+
+    def test_scratch_failure(self):
+        root = os.path.join(tempfile.gettempdir(), 'cpymad-missing', 'dir')
+        self.assertRaises(OSError, ScratchDirectory, root)
+        # cleanup of a partially initialized object is a no-op:
+        ScratchDirectory.__new__(ScratchDirectory).cleanup()
+
     # def test_survey(self):
     # def test_aperture(self):
     # def test_use(self):
@@ -93,6 +255,165 @@ class TestMadx(unittest.TestCase, _compat.TestCase):
         val = self.mad.evaluate("1/QP_K1")
         self.assertAlmostEqual(val, 0.5)
 
+    def test_globals(self):
+        self.assertAlmostEqual(self.mad.globals['qp_k1'], 2)
+        self.assertRaises(KeyError, lambda: self.mad.globals['unknown'])
+        self.mad.globals[['qp_k1', 'new_var']] = [0.1, 1/3.]
+        self.assertEqual(list(self.mad.globals[['QP_K1', 'new_var']]),
+                         [0.1, 1/3.])
+        self.mad.globals.update({'qp_k1': 5})
+        self.assertAlmostEqual(self.mad.evaluate('qp_k1'), 5)
+
+    def test_globals_history(self):
+        fd, histfile = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            mad = Madx(histfile=histfile)
+            mad.globals['x_hist'] = 2.5
+            mad.globals.update({'y_hist': 1})
+            with open(histfile) as f:
+                text = f.read()
+            del mad
+        finally:
+            os.remove(histfile)
+        self.assertTrue('x_hist = 2.5;' in text)
+        self.assertTrue('y_hist = 1.0;' in text)
+
+    def test_dump_globals(self):
+        self.mad.command('qp_kd := -qp_k1;')
+        table = self.mad.dump_globals()
+        index = dict((name, i) for i, name in enumerate(table['name']))
+        k1 = index['qp_k1']
+        kd = index['qp_kd']
+        self.assertEqual(table['value'][k1], 2)
+        self.assertEqual(table['kind'][k1], 'direct')
+        self.assertEqual(table['value'][kd], -2)
+        self.assertEqual(table['kind'][kd], 'deferred')
+        self.assertEqual(table['expr'][kd], '-qp_k1')
+
+    def test_assign_errors(self):
+        self.mad.command('beam, sequence=s1;')
+        self.mad.use('s1')
+        self.mad.assign_errors(['qp:1', 'sb'],
+                               dx=[1e-3, 2e-3], dpsi=1e-4,
+                               knl=[[0, 1e-5], [0, 0]])
+        errors = self.mad.get_errors()
+        rows = dict((name, i) for i, name in enumerate(errors['name']))
+        self.assertEqual(len(rows), 2)
+        self.assertAlmostEqual(errors['dx'][rows['qp:1']], 1e-3)
+        self.assertAlmostEqual(errors['dx'][rows['sb:1']], 2e-3)
+        self.assertAlmostEqual(errors['dpsi'][rows['sb:1']], 1e-4)
+        self.assertAlmostEqual(errors['k1l'][rows['qp:1']], 1e-5)
+        self.assertAlmostEqual(errors['dy'][rows['qp:1']], 0)
+        self.assertRaises(ValueError, self.mad.assign_errors, ['qp:1'],
+                          foo=1)
+        self.assertRaises(ValueError, self.mad.assign_errors, ['foo'],
+                          dx=1)
+        # an empty selection is a no-op:
+        self.mad.assign_errors([], dx=1, knl=[[1e-5]])
+        self.assertEqual(len(self.mad.get_errors()['name']), 2)
+
+    def test_track(self):
+        self.mad.command('beam, sequence=s1;')
+        self.mad.use('s1')
+        particles = [[1e-3, 0, 0, 0, 0, 0],
+                     [0, 0, 2e-3, 0, 0, 0]]
+        result = self.mad.track(particles, 3, observe=['sb'], onepass=True)
+        self.assertEqual(result.shape, (4, 2, 2, 6))
+        self.assertAlmostEqual(result[0, 0, 0, 0], 1e-3)
+        self.assertAlmostEqual(result[0, 0, 1, 2], 2e-3)
+        self.assertAlmostEqual(result[0, 0, 1, 0], 0)
+
+    def test_state_fingerprint(self):
+        self.mad.command('beam, sequence=s1;')
+        self.mad.use('s1')
+        first = self.mad.state_fingerprint()
+        self.assertEqual(self.mad.state_fingerprint(), first)
+        seq = self.mad.state_fingerprint('sequence')
+        self.mad.globals['qp_k1'] = 3
+        self.assertNotEqual(self.mad.state_fingerprint(), first)
+        self.assertEqual(self.mad.state_fingerprint('sequence'), seq)
+        self.mad.globals['qp_k1'] = 2
+        self.assertEqual(self.mad.state_fingerprint(), first)
+        elements = self.mad.state_fingerprint('elements')
+        self.mad.command('mp: multipole, knl={0, 0.1};')
+        changed = self.mad.state_fingerprint('elements')
+        self.assertNotEqual(changed, elements)
+        self.mad.command('mp: multipole, knl={0, 0.2};')
+        self.assertNotEqual(self.mad.state_fingerprint('elements'), changed)
+        self.mad.assign_errors(['qp'], dx=1e-3)
+        self.assertNotEqual(self.mad.state_fingerprint(), first)
+        self.assertRaises(ValueError, self.mad.state_fingerprint, 'foo')
+        # cached digests are invalidated by sequence edits:
+        seq = self.mad.state_fingerprint('sequence')
+        self.assertEqual(self.mad.state_fingerprint('sequence'), seq)
+        with self.mad.get_sequence('s1').edit() as ed:
+            ed.move(['sb'], by=0.1)
+        self.assertNotEqual(self.mad.state_fingerprint('sequence'), seq)
+
+    def test_snapshot(self):
+        snap = self.mad.snapshot()
+        self.mad.command('qp_k1 := 2 * new_var;')
+        self.mad.globals['new_var'] = 3
+        self.assertAlmostEqual(self.mad.evaluate('qp_k1'), 6)
+        self.mad.restore(snap)
+        self.assertAlmostEqual(self.mad.evaluate('qp_k1'), 2)
+        self.mad.globals['new_var'] = 4
+        self.assertAlmostEqual(self.mad.evaluate('qp_k1'), 2)
+        self.mad.discard_snapshot(snap)
+        self.assertRaises(KeyError, self.mad.restore, snap)
+
+    def test_transaction(self):
+        with self.mad.transaction(elements=True):
+            self.mad.globals['qp_k1'] = 5
+            self.mad.command('qp->l = 4;')
+            self.assertAlmostEqual(self.mad.evaluate('qp->l'), 4)
+        self.assertAlmostEqual(self.mad.globals['qp_k1'], 2)
+        self.assertAlmostEqual(self.mad.evaluate('qp->l'), 1)
+
+    def test_dependency_graph(self):
+        self.mad.command('qp_kd := -qp_k1 * 1.5e-3;')
+        graph = self.mad.get_dependency_graph()
+        dependents = graph.dependents('qp_k1')
+        self.assertTrue('qp->k1' in dependents)
+        self.assertTrue('qp_kd' in dependents)
+        self.assertEqual(graph.dependents('qp_kd'), set())
+        self.assertEqual(graph.dependents('e'), set())
+
+    def test_dependency_graph_array(self):
+        self.mad.command('mp_k1 = 0.1;')
+        self.mad.command('mp: multipole, knl:={0, mp_k1, 2*mp_k1};')
+        graph = self.mad.get_dependency_graph()
+        self.assertEqual(graph.dependents('mp_k1'), set(['mp->knl']))
+
+    def test_transaction_array_attribute(self):
+        self.mad.command('mp_k1 = 0.1;')
+        self.mad.command('mp: multipole, knl:={0, mp_k1};')
+        with self.mad.transaction(elements=True):
+            self.mad.command('mp: multipole, knl={0, 0.5, 1};')
+            self.assertAlmostEqual(self.mad.evaluate('mp->knl[2]'), 0.5)
+        self.assertAlmostEqual(self.mad.evaluate('mp->knl[2]'), 0.1)
+        self.mad.globals['mp_k1'] = 0.2
+        self.assertAlmostEqual(self.mad.evaluate('mp->knl[2]'), 0.2)
+
+    def test_evaluate_many(self):
+        values, errors = self.mad.evaluate_many(["1/QP_K1", "1/(", "2*qp_k1"])
+        self.assertEqual(list(errors), [False, True, False])
+        self.assertAlmostEqual(values[0], 0.5)
+        self.assertNotEqual(values[1], values[1])
+        self.assertAlmostEqual(values[2], 4)
+
+    def test_evaluate_cache(self):
+        libmadx = self.mad._libmadx
+        libmadx.clear_expression_cache()
+        self.assertAlmostEqual(self.mad.evaluate("1/QP_K1"), 0.5)
+        self.mad.command('QP_K1 = 4;')
+        self.assertAlmostEqual(self.mad.evaluate("1 / qp_k1"), 0.25)
+        info = libmadx.get_expression_cache_info()
+        self.assertEqual(info['hits'], 1)
+        self.assertEqual(info['misses'], 1)
+        self.assertRaises(ValueError, self.mad.evaluate, "1/(")
+
     # def test_sequence_beam(self):
     # def test_sequence_twiss(self):
     # def test_sequence_twissname(self):
@@ -122,6 +443,75 @@ class TestMadx(unittest.TestCase, _compat.TestCase):
         self.assertAlmostEqual(float(sb1.angle), 3.14/4)
         self.assertEqual(str(qp1.k1).lower(), "qp_k1")
 
+    def test_sequence_get_elements_lazy(self):
+        seq = self.mad.get_sequence('s1')
+        # TWISS evaluates the expressions with QP_K1 = 2:
+        self.mad.command('beam, ex=1, ey=2, particle=electron, sequence=s1;')
+        self.mad.twiss(sequence='s1', betx=2.5, bety=3.5)
+        self.mad.command('QP_K1 = 4;')
+        elems = seq.get_elements(lazy=True)
+        qp1 = dict((el.name, el) for el in elems)['qp:1']
+        self.assertEqual(str(qp1.k1).lower(), "qp_k1")
+        self.assertAlmostEqual(float(qp1.k1), 2)
+        self.mad.update_expressions(elems)
+        self.assertAlmostEqual(float(qp1.k1), 4)
+
+    def test_sequence_get_elements_sparse(self):
+        elems = self.mad.get_sequence('s1').get_elements(sparse=True)
+        qp1 = dict((el.name, el) for el in elems)['qp:1']
+        self.assertItemsEqual(qp1.keys(), ['name', 'type', 'at', 'k1', 'l'])
+        self.assertEqual(str(qp1.k1).lower(), "qp_k1")
+
+    def test_build_sequence(self):
+        nan = float('nan')
+        seq = self.mad.build_sequence('s3', 10, {
+            'name': ['bq1', 'bq2', 'bm1'],
+            'class': ['quadrupole', 'quadrupole', 'marker'],
+            'at': [2, 5, 8],
+            'l': [1, 1, nan],
+            'k1': [0.25, -0.25, nan],
+        })
+        self.assertTrue(self.mad._libmadx.sequence_exists('s3'))
+        elems = dict((el.name, el) for el in seq.get_elements())
+        self.assertAlmostEqual(elems['bq1:1'].k1, 0.25)
+        self.assertAlmostEqual(elems['bq2:1'].k1, -0.25)
+        self.assertAlmostEqual(elems['bq2:1'].at, 4.5)
+        self.assertEqual(elems['bm1:1'].type, 'marker')
+
+    def test_sequence_edit(self):
+        seq = self.mad.get_sequence('s1')
+        with seq.edit() as ed:
+            ed.install(['mon1', 'mon2'], 'marker', at=[0.25, 2.5])
+            ed.remove(['sb'])
+        names = [el.name for el in seq.get_elements()]
+        self.assertTrue('mon1:1' in names)
+        self.assertTrue('mon2:1' in names)
+        self.assertFalse('sb:1' in names)
+
+    def test_sequence_get_elements_normalized(self):
+        elems = self.mad.get_sequence('s1').get_elements(normalized=True)
+        by_name = dict((el.name, el) for el in elems)
+        self.assertEqual(len(elems), len(by_name))
+        qp1 = by_name['qp:1']
+        qp2 = by_name['qp:2']
+        self.assertAlmostEqual(qp1.at, 0)
+        self.assertAlmostEqual(qp2.at, 1)
+        self.assertAlmostEqual(float(qp2.k1), 2)
+        self.assertEqual(qp1._definition, qp2._definition)
+        self.assertEqual(qp1._definition.name, 'qp')
+        self.assertEqual(qp1._definition.type, 'quadrupole')
+        # the definition is merged only on first access:
+        view = elems[0]
+        self.assertTrue(view._resolved is None)
+        self.assertEqual(view.name, 'qp:1')
+        self.assertTrue(view._resolved is not None)
+        self.assertAlmostEqual(qp1.l, 1)
+        self.assertEqual([el.name for el in elems[1:]],
+                         [el.name for el in list(elems)[1:]])
+        restored = pickle.loads(pickle.dumps(qp2))
+        self.assertEqual(restored.name, 'qp:2')
+        self.assertAlmostEqual(float(restored.k1), 2)
+
     def test_sequence_get_elements_s2(self):
         s2 = self._get_elems('s2')
         qp1 = s2['qp1:1']
@@ -134,6 +524,35 @@ class TestMadx(unittest.TestCase, _compat.TestCase):
         self.assertAlmostEqual(float(qp1.k1), 3)
         self.assertAlmostEqual(float(qp2.k1), 2)
 
+    def test_sequence_get_element_table(self):
+        table = self.mad.get_sequence('s2').get_element_table(['k1', 'angle'])
+        names = list(table.name)
+        qp1 = names.index('qp1:1')
+        qp2 = names.index('qp2:1')
+        self.assertLess(qp1, qp2)
+        self.assertEqual(table.type[qp1], 'quadrupole')
+        self.assertAlmostEqual(table.at[qp2], 1)
+        self.assertAlmostEqual(table.l[qp2], 2)
+        self.assertAlmostEqual(table.k1[qp1], 3)
+        self.assertAlmostEqual(table.k1[qp2], 2)
+        self.assertNotEqual(table.angle[qp1], table.angle[qp1])
+
+    def test_sequence_set_element_attributes(self):
+        seq = self.mad.get_sequence('s2')
+        seq.set_element_attributes(['qp1', 'qp2:1'], 'k1', [0.5, 1.5])
+        s2 = self._get_elems('s2')
+        self.assertAlmostEqual(float(s2['qp1:1'].k1), 0.5)
+        self.assertAlmostEqual(float(s2['qp2:1'].k1), 1.5)
+        self.assertRaises(ValueError, seq.set_element_attributes,
+                          ['qp1', 'unknown'], 'k1', 0)
+        self.assertRaises(ValueError, seq.set_element_attributes,
+                          ['qp1'], 'unknown', 0)
+        # qp1 is defined globally but not used in s1:
+        self.assertRaises(ValueError,
+                          self.mad.get_sequence('s1').set_element_attributes,
+                          ['qp1'], 'k1', 0)
+        self.assertAlmostEqual(float(self._get_elems('s2')['qp1:1'].k1), 0.5)
+
     # def test_sequence_get_expanded_elements(self):
 
 if __name__ == '__main__':